@@ -185,11 +185,11 @@
         logDebug(`Requesting OCR for ...${sourceUrl.slice(-30)}`);
         ocrDataCache.set(img, 'pending');
         const context = document.title;
-        let ocrRequestUrl = `${settings.ocrServerUrl}/ocr?url=${encodeURIComponent(sourceUrl)}&context=${encodeURIComponent(context)}`;
+        let ocrRequestUrl = `${settings.ocrServerUrl}/ocr?url=${encodeURIComponent(sourceUrl)}&context=${encodeURIComponent(context)}&add_space_on_merge=${settings.addSpaceOnMerge}`;
         if (settings.imageServerUser) ocrRequestUrl += `&user=${encodeURIComponent(settings.imageServerUser)}&pass=${encodeURIComponent(settings.imageServerPassword)}`;
         GM_xmlhttpRequest({
             method: 'GET', url: ocrRequestUrl, timeout: 45000,
-            onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.error) throw new Error(data.error); if (!Array.isArray(data)) throw new Error('Server response not a valid OCR data array.'); ocrDataCache.set(img, data); displayOcrResults(img); } catch (e) { logDebug(`OCR Error for ${sourceUrl.slice(-30)}: ${e.message}`); ocrDataCache.delete(img); } },
+            onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.error) throw new Error(data.error); if (!Array.isArray(data)) throw new Error('Server response not a valid OCR data array.'); ocrDataCache.set(img, data); displayOcrResults(img); const serverTiming = /^server-timing:\s*(.*)$/im.exec(res.responseHeaders || ''); if (serverTiming) logDebug(`OCR timing for ...${sourceUrl.slice(-30)}: ${serverTiming[1]}`); } catch (e) { logDebug(`OCR Error for ${sourceUrl.slice(-30)}: ${e.message}`); ocrDataCache.delete(img); } },
             onerror: () => { logDebug(`Connection error.`); ocrDataCache.delete(img); },
             ontimeout: () => { logDebug(`Request timed out.`); ocrDataCache.delete(img); }
         });
@@ -565,7 +565,7 @@
         UI.statusDiv.className = 'status-checking'; UI.statusDiv.textContent = 'Checking...';
         GM_xmlhttpRequest({
             method: 'GET', url: serverUrl, timeout: 5000,
-            onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.status === 'running') { UI.statusDiv.className = 'status-ok'; const jobs = data.active_preprocess_jobs ?? 'N/A'; UI.statusDiv.textContent = `Connected (Cache: ${data.items_in_cache} | Active Jobs: ${jobs})`; } else { throw new Error('Unresponsive'); } } catch (e) { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Invalid Response'; } },
+            onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.status === 'running') { UI.statusDiv.className = 'status-ok'; const jobs = data.active_preprocess_jobs ?? 'N/A'; UI.statusDiv.textContent = `Connected (Cache: ${data.items_in_cache ?? 'N/A'} | Active Jobs: ${jobs})`; } else { throw new Error('Unresponsive'); } } catch (e) { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Invalid Response'; } },
             onerror: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Connection Failed'; },
             ontimeout: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Timed Out'; }
         });
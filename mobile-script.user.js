@@ -97,7 +97,7 @@
     // --- Image Handling & OCR (Synced with PC) ---
     function observeImageForSrcChange(img) { const process = (src) => { if (src?.includes('/api/v1/manga/')) { primeImageForOcr(img); return true; } return false; }; if (process(img.src) || attachedAttributeObservers.has(img)) return; const attrObserver = new MutationObserver((mutations) => { if (mutations.some(m => m.attributeName === 'src' && process(img.src))) { attrObserver.disconnect(); attachedAttributeObservers.delete(img); } }); attrObserver.observe(img, { attributes: true }); attachedAttributeObservers.set(img, attrObserver); }
     function primeImageForOcr(img) { if (managedElements.has(img) || ocrDataCache.get(img) === 'pending') return; const doProcess = () => { img.crossOrigin = "anonymous"; processImage(img, img.src); }; if (img.complete && img.naturalHeight > 0) doProcess(); else img.addEventListener('load', doProcess, { once: true }); }
-    function processImage(img, sourceUrl) { if (ocrDataCache.has(img)) { displayOcrResults(img); return; } logDebug(`Requesting OCR for ...${sourceUrl.slice(-30)}`); ocrDataCache.set(img, 'pending'); const context = document.title; let ocrRequestUrl = `${settings.ocrServerUrl}/ocr?url=${encodeURIComponent(sourceUrl)}&context=${encodeURIComponent(context)}`; if (settings.imageServerUser) ocrRequestUrl += `&user=${encodeURIComponent(settings.imageServerUser)}&pass=${encodeURIComponent(settings.imageServerPassword)}`; GM_xmlhttpRequest({ method: 'GET', url: ocrRequestUrl, timeout: 45000, onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.error) throw new Error(data.error); if (!Array.isArray(data)) throw new Error('Server response not a valid OCR data array.'); ocrDataCache.set(img, data); displayOcrResults(img); } catch (e) { logDebug(`OCR Error for ${sourceUrl.slice(-30)}: ${e.message}`); ocrDataCache.delete(img); } }, onerror: () => { logDebug(`Connection error.`); ocrDataCache.delete(img); }, ontimeout: () => { logDebug(`Request timed out.`); ocrDataCache.delete(img); } }); }
+    function processImage(img, sourceUrl) { if (ocrDataCache.has(img)) { displayOcrResults(img); return; } logDebug(`Requesting OCR for ...${sourceUrl.slice(-30)}`); ocrDataCache.set(img, 'pending'); const context = document.title; let ocrRequestUrl = `${settings.ocrServerUrl}/ocr?url=${encodeURIComponent(sourceUrl)}&context=${encodeURIComponent(context)}&add_space_on_merge=${settings.addSpaceOnMerge}`; if (settings.imageServerUser) ocrRequestUrl += `&user=${encodeURIComponent(settings.imageServerUser)}&pass=${encodeURIComponent(settings.imageServerPassword)}`; GM_xmlhttpRequest({ method: 'GET', url: ocrRequestUrl, timeout: 45000, onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.error) throw new Error(data.error); if (!Array.isArray(data)) throw new Error('Server response not a valid OCR data array.'); ocrDataCache.set(img, data); displayOcrResults(img); const serverTiming = /^server-timing:\s*(.*)$/im.exec(res.responseHeaders || ''); if (serverTiming) logDebug(`OCR timing for ...${sourceUrl.slice(-30)}: ${serverTiming[1]}`); } catch (e) { logDebug(`OCR Error for ${sourceUrl.slice(-30)}: ${e.message}`); ocrDataCache.delete(img); } }, onerror: () => { logDebug(`Connection error.`); ocrDataCache.delete(img); }, ontimeout: () => { logDebug(`Request timed out.`); ocrDataCache.delete(img); } }); }
 
     // --- Rendering & Merging Logic ---
     function calculateAndApplyStylesForSingleBox(box, imgRect) {
@@ -361,7 +361,7 @@
         });
         document.addEventListener('ocr-log-update', () => { if (UI.debugModal && !UI.debugModal.classList.contains('is-hidden')) { UI.debugLogTextarea.value = debugLog.join('\n'); UI.debugLogTextarea.scrollTop = UI.debugLogTextarea.scrollHeight; } });
     }
-    function checkServerStatus() { const serverUrl = UI.serverUrlInput.value.trim(); if (!serverUrl) return; UI.statusDiv.className = 'status-checking'; UI.statusDiv.textContent = 'Checking...'; GM_xmlhttpRequest({ method: 'GET', url: serverUrl, timeout: 5000, onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.status === 'running') { UI.statusDiv.className = 'status-ok'; const jobs = data.active_preprocess_jobs ?? 'N/A'; UI.statusDiv.textContent = `Connected (Cache: ${data.items_in_cache} | Jobs: ${jobs})`; } else { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Server Unresponsive'; } } catch (e) { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Invalid Response'; } }, onerror: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Connection Failed'; }, ontimeout: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Timed Out'; } }); }
+    function checkServerStatus() { const serverUrl = UI.serverUrlInput.value.trim(); if (!serverUrl) return; UI.statusDiv.className = 'status-checking'; UI.statusDiv.textContent = 'Checking...'; GM_xmlhttpRequest({ method: 'GET', url: serverUrl, timeout: 5000, onload: (res) => { try { const data = JSON.parse(res.responseText); if (data.status === 'running') { UI.statusDiv.className = 'status-ok'; const jobs = data.active_preprocess_jobs ?? 'N/A'; UI.statusDiv.textContent = `Connected (Cache: ${data.items_in_cache ?? 'N/A'} | Jobs: ${jobs})`; } else { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Server Unresponsive'; } } catch (e) { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Invalid Response'; } }, onerror: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Connection Failed'; }, ontimeout: () => { UI.statusDiv.className = 'status-error'; UI.statusDiv.textContent = 'Timed Out'; } }); }
     function purgeServerCache() { if (!confirm("Permanently delete all items from the server's OCR cache?")) return; const btn = UI.purgeCacheBtn; const originalText = btn.textContent; btn.disabled = true; btn.textContent = 'Purging...'; GM_xmlhttpRequest({ method: 'POST', url: `${settings.ocrServerUrl}/purge-cache`, timeout: 10000, onload: (res) => { try { const data = JSON.parse(res.responseText); alert(data.message || data.error); checkServerStatus(); } catch (e) { alert('Failed to parse server response.'); } }, onerror: () => alert('Failed to connect to server to purge cache.'), ontimeout: () => alert('Request to purge cache timed out.'), onloadend: () => { btn.disabled = false; btn.textContent = originalText; } }); }
     
     function createMeasurementSpan() {
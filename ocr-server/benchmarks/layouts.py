@@ -0,0 +1,105 @@
+"""Synthetic OCR line layouts for benchmarking auto-merge.
+
+Layouts are built from the blocks found on real pages: speech bubbles of vertical
+Japanese columns read right to left, furigana beside those columns, horizontal
+narration boxes and large sound effects. Lines are returned as `OcrLine`s normalized
+to the image, the same as engine output.
+"""
+
+import math
+import random
+
+from engines import OcrLine
+
+# name: (width px, height px, bubble grid columns, furigana probability per column)
+LAYOUTS = {
+    "page": (1400, 2000, 3, 0.2),
+    "furigana": (1400, 2000, 3, 0.9),
+    "strip": (800, 50000, 1, 0.2),
+}
+
+
+def _vertical_bubble(rnd, furigana_rate):
+    """Columns of one speech bubble as (x, y, width, height) relative to its corner."""
+    glyph = rnd.uniform(22, 30)
+    column_gap = glyph * rnd.uniform(0.5, 0.7)
+    columns = rnd.randint(2, 6)
+    rects = []
+    x = (columns - 1) * (glyph + column_gap)
+    for _ in range(columns):
+        y = rnd.uniform(0, glyph * 0.5)
+        length = glyph * rnd.randint(3, 12)
+        rects.append((x, y, glyph, length))
+        if rnd.random() < furigana_rate:
+            # Readings sit just right of the kanji they belong to, at half size.
+            ruby = glyph * 0.45
+            for _ in range(rnd.randint(1, 2)):
+                ruby_y = y + rnd.uniform(0, max(length - glyph * 2, 0))
+                rects.append((x + glyph + 1, ruby_y, ruby, ruby * rnd.randint(2, 4)))
+        x -= glyph + column_gap
+    return rects
+
+
+def _narration_box(rnd):
+    glyph = rnd.uniform(20, 28)
+    return [
+        (rnd.uniform(0, glyph), row * glyph * 1.3, glyph * rnd.randint(6, 20), glyph)
+        for row in range(rnd.randint(1, 4))
+    ]
+
+
+def _sound_effect(rnd):
+    glyph = rnd.uniform(60, 140)
+    if rnd.random() < 0.5:
+        return [(0, 0, glyph * rnd.randint(2, 5), glyph)]
+    return [(0, 0, glyph, glyph * rnd.randint(2, 5))]
+
+
+def _block(rnd, furigana_rate):
+    roll = rnd.random()
+    if roll < 0.7:
+        return _vertical_bubble(rnd, furigana_rate)
+    if roll < 0.88:
+        return _narration_box(rnd)
+    return _sound_effect(rnd)
+
+
+def generate_layout(kind: str, line_count: int, seed: int = 0) -> tuple[list[OcrLine], int, int]:
+    """Returns about `line_count` lines of a `kind` layout and the image size.
+
+    Blocks are dropped into a jittered grid of cells, one per block, so lines get
+    denser as `line_count` grows but the layout keeps its shape.
+    """
+    width, height, grid_columns, furigana_rate = LAYOUTS[kind]
+    rnd = random.Random(seed)
+
+    blocks = []
+    total = 0
+    while total < line_count:
+        block = _block(rnd, furigana_rate)[: line_count - total]
+        blocks.append(block)
+        total += len(block)
+
+    grid_rows = math.ceil(len(blocks) / grid_columns)
+    cell_width, cell_height = width / grid_columns, height / grid_rows
+    lines = []
+    for number, block in enumerate(blocks):
+        row, column = divmod(number, grid_columns)
+        block_width = max(x + w for x, _, w, _ in block)
+        block_height = max(y + h for _, y, _, h in block)
+        left = column * cell_width + rnd.uniform(0, max(cell_width - block_width, 0))
+        top = row * cell_height + rnd.uniform(0, max(cell_height - block_height, 0))
+        left = min(left, width - block_width)
+        top = min(top, height - block_height)
+        for x, y, w, h in block:
+            lines.append(OcrLine(
+                text="あ" * max(round(max(w, h) / min(w, h)), 1),
+                x=(left + x) / width,
+                y=(top + y) / height,
+                width=w / width,
+                height=h / height,
+                orientation=90.0 if h > w else 0.0,
+                font_size=0.04,
+                confidence=0.95,
+            ))
+    return lines, width, height
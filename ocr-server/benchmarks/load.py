@@ -0,0 +1,310 @@
+"""End-to-end load test of the OCR server.
+
+Starts a local image server and an OCR server running the stub engine in a
+temporary folder, then drives /ocr, /preprocess-chapter and the cache endpoints.
+Run from the ocr-server folder:
+
+    uv run python -m benchmarks.load --requests 2000 --concurrency 64
+    uv run python -m benchmarks.load --server aiohttp --latency 0.5 --output load.json
+
+The /ocr phases report throughput and latency percentiles. The hit ratio is the
+share of successful requests that did not need an engine call, so it counts
+coalesced requests as hits.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from PIL import Image, ImageDraw
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+
+def _page_image(width, height):
+    """A JPEG page with rows of dark blocks, so no band of it looks blank."""
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    for top in range(20, height - 40, 60):
+        draw.rectangle((40, top, width - 40, top + 30), fill="black")
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ImageServer:
+    """Serves the page image at /chapter/<chapter>/<page>, also to HEAD requests.
+    Pages at or past `pages_per_chapter` are 404, like the end of a chapter. The
+    path is appended after the end of the JPEG data, so every page decodes to the
+    same picture but has its own content hash."""
+
+    def __init__(self, image: bytes, pages_per_chapter: int):
+        outer = self
+        self.requests = 0
+        # Downloads of pages past the end of a chapter; HEAD requests are not counted.
+        self.missing_requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def _respond(self, send_body):
+                parts = self.path.strip("/").split("/")
+                if len(parts) == 3 and parts[0] == "chapter" and parts[2].isdigit() and int(parts[2]) < pages_per_chapter:
+                    outer.requests += send_body
+                    body = image + self.path.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if send_body:
+                        self.wfile.write(body)
+                else:
+                    outer.missing_requests += send_body
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def page_url(self, chapter, page):
+        return f"{self.base_url}/chapter/{chapter}/{page}"
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir, log):
+    port = _free_port()
+    command = [
+        sys.executable, SERVER_SCRIPT,
+        "--port", str(port),
+        "--server", args.server,
+        "-e", "stub",
+        "--engine-option", f"latency={args.latency}",
+        "--engine-option", f"lines={args.lines}",
+        "--engine-concurrency", str(args.engine_concurrency),
+    ]
+    process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_ready(session, base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("OCR server exited during startup")
+        try:
+            async with session.get(base_url + "/") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("OCR server did not start in time")
+
+
+async def get_status(session, base_url):
+    async with session.get(base_url + "/") as response:
+        return await response.json()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+async def ocr_phase(name, session, base_url, urls, concurrency):
+    before = await get_status(session, base_url)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(url):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.get(base_url + "/ocr", params={"url": url, "context": "load-test"}) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(url) for url in urls))
+    duration = time.perf_counter() - start
+    after = await get_status(session, base_url)
+
+    engine_calls = after["requests_processed"] - before["requests_processed"]
+    latencies.sort()
+    return {
+        "phase": name,
+        "requests": len(urls),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "requests_per_s": round(len(urls) / duration, 1),
+        "p50_ms": _round(_percentile(latencies, 0.50)),
+        "p95_ms": _round(_percentile(latencies, 0.95)),
+        "p99_ms": _round(_percentile(latencies, 0.99)),
+        "engine_calls": engine_calls,
+        "hit_ratio": round(1 - engine_calls / len(latencies), 3) if latencies else None,
+    }
+
+
+async def preprocess_phase(session, base_url, images, chapters, first_chapter):
+    before = await get_status(session, base_url)
+    missing_before = images.missing_requests
+    start = time.perf_counter()
+    for chapter in range(first_chapter, first_chapter + chapters):
+        payload = {"baseUrl": images.page_url(chapter, ""), "context": f"load-test {chapter}"}
+        async with session.post(base_url + "/preprocess-chapter", json=payload) as response:
+            await response.read()
+    while True:
+        status = await get_status(session, base_url)
+        if not status["active_preprocess_jobs"] and not status["queued_preprocess_jobs"]:
+            break
+        await asyncio.sleep(0.2)
+    duration = time.perf_counter() - start
+    after = await get_status(session, base_url)
+
+    pages = after["requests_processed"] - before["requests_processed"]
+    return {
+        "phase": "preprocess",
+        "chapters": chapters,
+        "pages": pages,
+        "duration_s": round(duration, 3),
+        "pages_per_s": round(pages / duration, 1),
+        "downloads_past_end": images.missing_requests - missing_before,
+    }
+
+
+async def cache_phase(session, base_url):
+    results = {"phase": "cache"}
+
+    start = time.perf_counter()
+    async with session.get(base_url + "/export-cache") as response:
+        exported = await response.read()
+    results["export_ms"] = _round((time.perf_counter() - start) * 1000)
+    results["export_bytes"] = len(exported)
+
+    start = time.perf_counter()
+    async with session.post(base_url + "/purge-cache") as response:
+        await response.read()
+    results["purge_ms"] = _round((time.perf_counter() - start) * 1000)
+
+    form = aiohttp.FormData()
+    form.add_field("cacheFile", exported, filename="ocr-cache.json", content_type="application/json")
+    start = time.perf_counter()
+    async with session.post(base_url + "/import-cache", data=form) as response:
+        imported = await response.json()
+    results["import_ms"] = _round((time.perf_counter() - start) * 1000)
+    results["imported_items"] = imported.get("total_items_in_cache")
+    return results
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+async def run(args, images, process, base_url):
+    rnd = random.Random(args.seed)
+    chapters = -(-args.unique_pages // args.pages_per_chapter)
+    pool = [images.page_url(page // args.pages_per_chapter, page % args.pages_per_chapter) for page in range(args.unique_pages)]
+    urls = [rnd.choice(pool) for _ in range(args.requests)]
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency + 4)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_until_ready(session, base_url, process)
+        phases = [
+            await ocr_phase("ocr-cold", session, base_url, urls, args.concurrency),
+            await ocr_phase("ocr-warm", session, base_url, urls, args.concurrency),
+        ]
+        if args.chapters:
+            phases.append(await preprocess_phase(session, base_url, images, args.chapters, chapters))
+        phases.append(await cache_phase(session, base_url))
+    return phases
+
+
+def _print_phases(phases):
+    for phase in phases:
+        name = phase["phase"]
+        details = ", ".join(f"{key}={value}" for key, value in phase.items() if key != "phase")
+        print(f"{name:<11} {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the OCR server with a stub engine.")
+    parser.add_argument("--server", choices=("waitress", "aiohttp"), default="waitress", help="HTTP server to test.")
+    parser.add_argument("--requests", type=int, default=1000, help="/ocr requests per phase.")
+    parser.add_argument("--concurrency", type=int, default=32, help="/ocr requests in flight at once.")
+    parser.add_argument("--unique-pages", type=int, default=200, help="Distinct page URLs the /ocr requests pick from.")
+    parser.add_argument("--chapters", type=int, default=4, help="Chapters to pre-process, 0 to skip.")
+    parser.add_argument("--pages-per-chapter", type=int, default=20, help="Pages served per chapter.")
+    parser.add_argument("--page-size", default="1000x1400", help="Page size as WIDTHxHEIGHT.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stub engine takes per call.")
+    parser.add_argument("--lines", type=int, default=40, help="Lines the stub engine returns per call.")
+    parser.add_argument("--engine-concurrency", type=int, default=8, help="Engine calls in flight at once.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request order.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.page_size.lower().split("x"))
+    images = ImageServer(_page_image(width, height), args.pages_per_chapter)
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = os.path.join(workdir, "server.log")
+        with open(log_path, "w", encoding="utf-8") as log:
+            process, base_url = start_server(args, workdir, log)
+            try:
+                phases = asyncio.run(run(args, images, process, base_url))
+            except Exception:
+                with open(log_path, "r", encoding="utf-8") as f:
+                    print("".join(f.readlines()[-20:]), file=sys.stderr)
+                raise
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+                images.close()
+
+    _print_phases(phases)
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != "output"}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "phases": phases}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Times auto-merge on synthetic layouts.
+
+Run from the ocr-server folder:
+
+    uv run python -m benchmarks.merge --output merge.json
+    uv run python -m benchmarks.merge --compare merge.json
+
+Every case reports the time spent grouping lines and the time of the whole
+merge, both as the fastest and the median of `--repeat` runs, in milliseconds.
+`--output` writes the results as JSON; `--compare` prints how each case
+changed against such a file.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import server
+from benchmarks.layouts import LAYOUTS, generate_layout
+
+DEFAULT_LINE_COUNTS = {
+    "page": [50, 200, 1000],
+    "furigana": [50, 200, 1000],
+    "strip": [1000, 5000, 20000],
+}
+
+# Overrides of server.AUTO_MERGE_CONFIG.
+PRESETS = {
+    "default": {},
+    "tight": {"dist_k": 0.8, "font_ratio": 1.15, "overlap_min": 0.3},
+    "loose": {"dist_k": 2.0, "font_ratio": 1.6, "overlap_min": 0.05},
+}
+
+# How many lines a merge needs before it tests pairs with NumPy.
+PATHS = {
+    "numpy": 0,
+    "python": sys.maxsize,
+}
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    # auto_merge_ocr_data logs every call, keep that out of the output and the timing.
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def run_case(layout, line_count, preset, path, repeat, seed):
+    lines, width, height = generate_layout(layout, line_count, seed)
+    config = {**server.AUTO_MERGE_CONFIG, **PRESETS[preset]}
+    server.NUMPY_MERGE_MIN_LINES = PATHS[path]
+
+    group_times, merge_times = [], []
+    for _ in range(repeat):
+        group_ms, groups = _timed(server._group_ocr_data, lines, width, height, config)
+        merge_ms, merged = _timed(server.auto_merge_ocr_data, lines, width, height, config)
+        group_times.append(group_ms)
+        merge_times.append(merge_ms)
+
+    return {
+        "layout": layout,
+        "lines": len(lines),
+        "preset": preset,
+        "path": path,
+        "groups": len(groups),
+        "merged_lines": len(merged),
+        "group_ms_min": round(min(group_times), 3),
+        "group_ms_median": round(statistics.median(group_times), 3),
+        "merge_ms_min": round(min(merge_times), 3),
+        "merge_ms_median": round(statistics.median(merge_times), 3),
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def _case_key(result):
+    return result["layout"], result["lines"], result["preset"], result["path"]
+
+
+def _print_results(results, baseline):
+    previous = {_case_key(result): result for result in baseline or []}
+    print(f"{'layout':<9} {'lines':>6} {'preset':<8} {'path':<7} {'groups':>6} {'group ms':>9} {'merge ms':>9}"
+          + ("  change" if baseline is not None else ""))
+    for result in results:
+        row = (f"{result['layout']:<9} {result['lines']:>6} {result['preset']:<8} {result['path']:<7} "
+               f"{result['groups']:>6} {result['group_ms_median']:>9.2f} {result['merge_ms_median']:>9.2f}")
+        if (old := previous.get(_case_key(result))) is not None:
+            row += f"  {result['merge_ms_median'] / old['merge_ms_median'] - 1:+.0%}"
+            if old["groups"] != result["groups"]:
+                row += f" (groups was {old['groups']})"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark auto-merge on synthetic layouts.")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help="Comma-separated layouts.")
+    parser.add_argument("--lines", help="Comma-separated line counts, overriding each layout's defaults.")
+    parser.add_argument("--presets", default=",".join(PRESETS), help="Comma-separated config presets.")
+    parser.add_argument("--paths", default=",".join(PATHS), help="Comma-separated pair test paths.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the layout generator.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare against results written by --output.")
+    args = parser.parse_args()
+
+    paths = args.paths.split(",")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = []
+    for layout in args.layouts.split(","):
+        line_counts = [int(n) for n in args.lines.split(",")] if args.lines else DEFAULT_LINE_COUNTS[layout]
+        for line_count in line_counts:
+            for preset in args.presets.split(","):
+                for path in paths:
+                    results.append(run_case(layout, line_count, preset, path, args.repeat, args.seed))
+
+    _print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": _environment(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
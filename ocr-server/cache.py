@@ -0,0 +1,401 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Hashable, Iterator
+
+
+class CacheStore(ABC):
+    """Base class for persistent OCR cache stores. Every write is its own durable
+    operation, so the server never has to rewrite the whole cache to add a page.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> dict | None:
+        pass
+
+    @abstractmethod
+    def get_by_hash(self, content_hash: str) -> dict | None:
+        """Returns any entry whose `content_hash` matches, whatever its key."""
+        pass
+
+    @abstractmethod
+    def contains(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, entry: dict) -> None:
+        pass
+
+    @abstractmethod
+    def put_many(self, entries: dict[str, dict]) -> int:
+        """Adds entries whose key is not stored yet and returns how many were added."""
+        pass
+
+    @abstractmethod
+    def clear(self) -> int:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def keys(self) -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    def items(self) -> Iterator[tuple[str, dict]]:
+        pass
+
+    @abstractmethod
+    def items_after(self, after_key: str | None, limit: int) -> list[tuple[str, dict]]:
+        """Returns up to `limit` entries in key order, starting after `after_key` or at
+        the first key when it is None. Each call is a single read, so a long walk over
+        the store can continue from any thread."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteCacheStore(CacheStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            entry TEXT NOT NULL,
+            content_hash TEXT
+        );
+        CREATE INDEX IF NOT EXISTS entries_content_hash ON entries (content_hash);
+    """
+
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3 connections must not be shared between threads, so every worker
+        # thread gets its own. WAL mode lets readers run while a write is committed.
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if columns and "content_hash" not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN content_hash TEXT")
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # NORMAL is crash-safe in WAL mode; only the last commits before a power
+            # loss can be rolled back, the database itself is never corrupted.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Reads go through a memory map of the database file, so looking up an
+            # entry by key is a B-tree walk over mapped pages instead of read() calls.
+            conn.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute("SELECT entry FROM entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_hash(self, content_hash):
+        row = self._connection().execute(
+            "SELECT entry FROM entries WHERE content_hash = ? LIMIT 1", (content_hash,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def contains(self, key):
+        return self._connection().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, entry):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, entry, content_hash) VALUES (?, ?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False), entry.get("content_hash")),
+            )
+
+    def put_many(self, entries):
+        conn = self._connection()
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO entries (key, entry, content_hash) VALUES (?, ?, ?)",
+                (
+                    (key, json.dumps(entry, ensure_ascii=False), entry.get("content_hash"))
+                    for key, entry in entries.items()
+                ),
+            )
+            return conn.total_changes - before
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM entries").rowcount
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def keys(self):
+        for (key,) in self._connection().execute("SELECT key FROM entries"):
+            yield key
+
+    def items(self):
+        for key, entry in self._connection().execute("SELECT key, entry FROM entries"):
+            yield key, json.loads(entry)
+
+    def items_after(self, after_key, limit):
+        if after_key is None:
+            rows = self._connection().execute(
+                "SELECT key, entry FROM entries ORDER BY key LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = self._connection().execute(
+                "SELECT key, entry FROM entries WHERE key > ? ORDER BY key LIMIT ?", (after_key, limit)
+            ).fetchall()
+        return [(key, json.loads(entry)) for key, entry in rows]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class LRUCache:
+    """Thread-safe LRU map bounded by entry count and by an approximate byte size.
+    A limit of 0 disables that bound.
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, count_miss: bool = True):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value, size: int = 0) -> None:
+        with self._lock:
+            if (old := self._data.pop(key, None)) is not None:
+                self.total_bytes -= old[1]
+            self._data[key] = (value, size)
+            self.total_bytes += size
+            while self._data and self._over_limit():
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def has_room(self, size: int = 0) -> bool:
+        with self._lock:
+            return not (
+                (self.max_entries and len(self._data) >= self.max_entries)
+                or (self.max_bytes and self.total_bytes + size > self.max_bytes)
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "approx_bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _over_limit(self) -> bool:
+        return bool(
+            (self.max_entries and len(self._data) > self.max_entries)
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        )
+
+
+class OcrCache:
+    """Two-tier OCR cache: a bounded in-memory LRU of hot entries in front of a
+    `CacheStore`. `mode` decides what is loaded at startup: "eager" keeps the key
+    index and warms the LRU until it is full, "keys" only keeps the key index, and
+    "lazy" loads nothing and checks the store on every memory miss.
+    """
+
+    MODES = ("eager", "keys", "lazy")
+
+    def __init__(self, store: CacheStore, mode: str = "lazy", max_entries: int = 0, max_bytes: int = 0):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid cache mode: {mode}")
+        self.store = store
+        self.mode = mode
+        self.memory = LRUCache(max_entries, max_bytes)
+        self._lock = threading.Lock()
+        self._keys: set[str] | None = None
+        self.disk_hits = 0
+        self.misses = 0
+        if mode == "eager":
+            self._keys = set()
+            for key, entry in store.items():
+                self._keys.add(key)
+                if self.memory.has_room(size := _approx_size(entry)):
+                    self.memory.put(key, entry, size)
+        elif mode == "keys":
+            self._keys = set(store.keys())
+
+    def get(self, key: str) -> dict | None:
+        if (entry := self.memory.get(key)) is not None:
+            return entry
+        if self._keys is not None:
+            with self._lock:
+                indexed = key in self._keys
+            if not indexed:
+                self._record_miss()
+                return None
+        entry = self.store.get(key)
+        if entry is None:
+            self._record_miss()
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self.memory.put(key, entry, _approx_size(entry))
+        return entry
+
+    def get_from_memory(self, key: str) -> dict | None:
+        """Returns the entry if it is in the memory tier. Never touches the store, so it
+        is safe to call on an event loop; a None still needs a `get`."""
+        return self.memory.get(key, count_miss=False)
+
+    def get_by_hash(self, content_hash: str) -> dict | None:
+        return self.store.get_by_hash(content_hash)
+
+    def __contains__(self, key: str) -> bool:
+        if self._keys is not None:
+            with self._lock:
+                return key in self._keys
+        return self.store.contains(key)
+
+    def __len__(self) -> int:
+        if self._keys is not None:
+            with self._lock:
+                return len(self._keys)
+        return self.store.count()
+
+    def indexed_count(self) -> int | None:
+        """Number of entries if the key index is kept, None in "lazy" mode, where
+        counting them means a scan of the store."""
+        if self._keys is None:
+            return None
+        with self._lock:
+            return len(self._keys)
+
+    def is_empty(self) -> bool:
+        if self._keys is not None:
+            with self._lock:
+                return not self._keys
+        return not self.store.items_after(None, 1)
+
+    def put(self, key: str, entry: dict) -> None:
+        self.store.put(key, entry)
+        self._remember(key, entry)
+
+    def put_many(self, entries: dict[str, dict]) -> int:
+        new_entries = {key: entry for key, entry in entries.items() if key not in self}
+        added = self.store.put_many(new_entries)
+        with self._lock:
+            if self._keys is not None:
+                self._keys.update(new_entries)
+        return added
+
+    def clear(self) -> int:
+        with self._lock:
+            self.memory.clear()
+            if self._keys is not None:
+                self._keys.clear()
+            return self.store.clear()
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        return self.store.items()
+
+    def items_after(self, after_key: str | None, limit: int) -> list[tuple[str, dict]]:
+        return self.store.items_after(after_key, limit)
+
+    def stats(self) -> dict:
+        memory_stats = self.memory.stats()
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "memory_entries": memory_stats["entries"],
+                "memory_approx_bytes": memory_stats["approx_bytes"],
+                "memory_hits": memory_stats["hits"],
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": memory_stats["evictions"],
+            }
+
+    def _record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def _remember(self, key: str, entry: dict) -> None:
+        with self._lock:
+            if self._keys is not None:
+                self._keys.add(key)
+        self.memory.put(key, entry, _approx_size(entry))
+
+
+def _approx_size(entry: dict) -> int:
+    return len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+
+def initialize_cache_store(path: str) -> CacheStore:
+    return SQLiteCacheStore(path)
+
+
+def normalize_cache_entry(value) -> dict | None:
+    """Accepts the current `{"context", "raw", ...}` shape, the merged-only
+    `{"context", "data"}` shape and bare result lists written by older versions
+    of the server."""
+    if isinstance(value, list):
+        return {"context": "Imported Data", "data": value}
+    if isinstance(value, dict) and ("raw" in value or "data" in value):
+        return value
+    return None
+
+
+def migrate_legacy_json(store: CacheStore, json_path: str) -> int:
+    """Imports a legacy `ocr-cache.json` into the store once, then renames it so the
+    import is not repeated after a purge."""
+    if not os.path.exists(json_path):
+        return 0
+    with open(json_path, "r", encoding="utf-8") as f:
+        legacy_data = json.load(f)
+    entries = {}
+    if isinstance(legacy_data, dict):
+        for key, value in legacy_data.items():
+            if (entry := normalize_cache_entry(value)) is not None:
+                entries[key] = entry
+    added = store.put_many(entries)
+    os.replace(json_path, json_path + ".migrated")
+    return added
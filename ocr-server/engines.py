@@ -1,10 +1,21 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from math import pi
+from multiprocessing import resource_tracker, shared_memory
 from typing import TypedDict
 
 
 import chrome_lens_py
 from chrome_lens_py.utils.lens_betterproto import LensOverlayObjectsResponse
+from imaging import plan_chunks
+from PIL import Image as PILImage
 from PIL.Image import Image
 
 
@@ -23,22 +34,206 @@ class Bubble(TypedDict):
     confidence: float
 
 
+class OcrLine:
+    """A recognized line as it moves from an engine through auto-merge. Bounding box
+    fields are normalized to the image like `tightBoundingBox`; `to_bubble` gives the
+    serialized form that is cached and returned to clients.
+    """
+
+    __slots__ = ("text", "x", "y", "width", "height", "orientation", "font_size", "confidence")
+
+    def __init__(self, text: str, x: float, y: float, width: float, height: float,
+                 orientation: float = 0.0, font_size: float = 0.04, confidence: float = 0.98):
+        self.text = text
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.orientation = orientation
+        self.font_size = font_size
+        self.confidence = confidence
+
+    @classmethod
+    def from_bubble(cls, bubble: Bubble) -> "OcrLine":
+        bbox = bubble["tightBoundingBox"]
+        return cls(
+            bubble["text"], bbox["x"], bbox["y"], bbox["width"], bbox["height"],
+            bubble.get("orientation", 0.0), bubble.get("font_size", 0.04), bubble.get("confidence", 0.98),
+        )
+
+    def to_bubble(self) -> Bubble:
+        return Bubble(
+            text=self.text,
+            tightBoundingBox=BoundingBox(x=self.x, y=self.y, width=self.width, height=self.height),
+            orientation=self.orientation,
+            font_size=self.font_size,
+            confidence=self.confidence,
+        )
+
+
+# Lines of neighbouring chunks whose boxes overlap by more than this share of the
+# smaller box are the same line, recognized in the rows both chunks cover.
+DUPLICATE_LINE_OVERLAP = 0.5
+
+
+def _overlap_share(a: OcrLine, b: OcrLine) -> float:
+    width = min(a.x + a.width, b.x + b.width) - max(a.x, b.x)
+    height = min(a.y + a.height, b.y + b.height) - max(a.y, b.y)
+    if width <= 0 or height <= 0:
+        return 0.0
+    smaller = min(a.width * a.height, b.width * b.height)
+    return width * height / smaller if smaller > 0 else 0.0
+
+
+def join_chunk_lines(chunk_lines: list[list[OcrLine]], chunk_bands: list[tuple[int, int]],
+                     full_height: int) -> list[OcrLine]:
+    """Joins the lines of the chunks of a tall image, top to bottom. Chunks cut through
+    content overlap, so a line in the rows two chunks share is usually recognized by
+    both, once cut short by the edge of one of them. Of two lines there whose boxes
+    mostly overlap, only the taller is kept. Lines are in full-image coordinates."""
+    kept = [list(lines) for lines in chunk_lines]
+    for index in range(1, len(kept)):
+        band_top = chunk_bands[index][0] / full_height
+        band_bottom = chunk_bands[index - 1][1] / full_height
+        if band_top >= band_bottom:
+            continue
+
+        def in_band(line):
+            return line.y < band_bottom and line.y + line.height > band_top
+
+        above = [line for line in kept[index - 1] if in_band(line)]
+        for line in [line for line in kept[index] if in_band(line)]:
+            duplicate = next((other for other in above if _overlap_share(line, other) > DUPLICATE_LINE_OVERLAP), None)
+            if duplicate is None:
+                continue
+            if line.height > duplicate.height:
+                kept[index - 1].remove(duplicate)
+                above.remove(duplicate)
+            else:
+                kept[index].remove(line)
+    return [line for lines in kept for line in lines]
+
+
 class Engine(ABC):
     """Base class for OCR engines. Each engine should implement the `ocr` method
-    which processes an image and returns a list of Bubble objects.
+    which processes an image and returns a list of OcrLine objects.
     """
 
+    # Stored with every cached result so raw output can be traced to its engine.
+    name = "unknown"
+    # Upper bound on concurrent `bounded_ocr` calls, e.g. chunks of one tall image.
+    max_concurrency = 4
+    # Calls waiting for the concurrency bound and calls running, for monitoring.
+    waiting_calls = 0
+    running_calls = 0
+    _semaphore: asyncio.Semaphore | None = None
+    # Image modes the engine takes as they are; images in other modes are converted to RGB.
+    image_modes: tuple[str, ...] = ("RGB", "L")
+
     @abstractmethod
-    async def ocr(self, img: Image) -> list[Bubble]:
+    async def ocr(self, img: Image) -> list[OcrLine]:
         pass
 
+    @classmethod
+    def useful_width(cls, width: int, height: int) -> int | None:
+        """The narrowest an image of this size can be decoded without losing detail the
+        engine would use, or None to always decode it at full size."""
+        return None
+
+    async def bounded_ocr(self, img: Image) -> list[OcrLine]:
+        """Runs `ocr` under the engine's concurrency bound. The semaphore binds to the
+        first event loop that waits on it, so always call this from the same loop."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.waiting_calls += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting_calls -= 1
+        self.running_calls += 1
+        try:
+            return await self.ocr(img)
+        finally:
+            self.running_calls -= 1
+            self._semaphore.release()
+
+
+# OneOCR worker processes each own an engine; set by _init_oneocr_worker.
+_worker_engine = None
+
+
+def _init_oneocr_worker():
+    global _worker_engine
+    import oneocr
+
+    _worker_engine = oneocr.OcrEngine()
+
+
+def _oneocr_worker_ready() -> bool:
+    return _worker_engine is not None
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Before 3.13 attaching also registers the block with this worker's resource
+    # tracker, which would unlink it from under the parent when the worker exits.
+    if os.name == "posix":
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _recognize_shared_chunk(shm_name: str, size: tuple[int, int], box: tuple[int, int, int, int]) -> dict:
+    shm = _attach_shared_memory(shm_name)
+    try:
+        # Maps the parent's RGBA pixels without copying; only the chunk is copied, and
+        # converted back to the RGB the image was decoded in.
+        full_image = PILImage.frombuffer("RGBA", size, shm.buf, "raw", "RGBA", 0, 1)
+        chunk_image = full_image.crop(box).convert("RGB")
+        del full_image
+        return _worker_engine.recognize_pil(chunk_image)
+    finally:
+        shm.close()
+
+
+class SharedImage:
+    """RGBA pixels of an image in a shared-memory block, so worker processes can read
+    it without the image being pickled and piped to them."""
+
+    def __init__(self, img: Image):
+        data = img.convert("RGBA").tobytes()
+        self.size = img.size
+        self.shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self.shm.buf[: len(data)] = data
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
 
 class OneOCR(Engine):
-    def __init__(self):
+    name = "oneocr"
+    # The engine is given RGB images, as it always has been.
+    image_modes = ("RGB",)
+
+    def __init__(self, workers: int | None = None):
+        # Number of worker processes, each with its own oneocr.OcrEngine.
+        # 0 runs the engine in this process on a background thread instead.
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_concurrency = max(self.workers, 1)
+        self.engine = None
+        self._engine_lock = threading.Lock()
+        self.executor: ProcessPoolExecutor | None = None
         try:
-            import oneocr
-
-            self.engine = oneocr.OcrEngine()
+            if self.workers > 0:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_oneocr_worker)
+                # Fails here rather than on the first page if workers cannot load the engine.
+                self.executor.submit(_oneocr_worker_ready).result()
+            else:
+                import oneocr
+
+                self.engine = oneocr.OcrEngine()
         except ImportError as e:
             print(f"[Warning] OneOCR import failed: {e}")
         except Exception as e:
@@ -49,49 +244,63 @@ class OneOCR(Engine):
         # The height of each chunk to process.
         # A value between 1000-2000 is a good starting point.
         self.CHUNK_HEIGHT = 1500
-        # The pixel overlap between chunks to prevent cutting text in half.
+        # The pixel overlap between chunks that have to be cut through content
+        # because no gutter was found, to prevent cutting text in half.
         self.OVERLAP = 150
 
     async def ocr(self, img):
-        chunk_image = self.process_image(img)
+        chunk_image = await self.process_image(img)
         # print(json.dumps(chunk_image, indent=2, ensure_ascii=False))
         return chunk_image
 
-    def process_image(self, img: Image) -> list[Bubble]:
+    async def process_image(self, img: Image) -> list[OcrLine]:
         full_width, full_height = img.size
-        y_offset = 0
-        all_transformed_results: list[Bubble] = []
+        shared_image = None
 
-        while y_offset < full_height:
+        async def process_chunk(y_offset: int, y_bottom: int) -> list[OcrLine]:
             # Define the crop box for the current chunk
-            box = (
-                0,
-                y_offset,
-                full_width,
-                min(y_offset + self.CHUNK_HEIGHT, full_height),
-            )
-
-            # Crop the image to get the current chunk
-            chunk_image = img.crop(box)
-            chunk_width, chunk_height = chunk_image.size
+            box = (0, y_offset, full_width, y_bottom)
+            chunk_width, chunk_height = box[2] - box[0], box[3] - box[1]
 
             # Run OCR on the smaller chunk
-            results = self.engine.recognize_pil(chunk_image)
-            data = self.transform(results, chunk_image.size)
+            results = await self.recognize(img, box, shared_image)
+            data = self.transform(results, (chunk_width, chunk_height))
 
             # Remap the coordinates of the detected text to be relative to the FULL image
-            for item in data:
-                bbox = item["tightBoundingBox"]
+            for line in data:
                 # Adjust y and height based on the chunk's position and size
-                bbox["y"] = (bbox["y"] * chunk_height + y_offset) / full_height
-                bbox["height"] = (bbox["height"] * chunk_height) / full_height
-                all_transformed_results.append(item)
+                line.y = (line.y * chunk_height + y_offset) / full_height
+                line.height = (line.height * chunk_height) / full_height
+            return data
 
-            # Move to the next chunk position
-            y_offset += self.CHUNK_HEIGHT - self.OVERLAP
-        return all_transformed_results
+        try:
+            if self.executor:
+                # Copying a large page into shared memory takes a while, keep it off the loop.
+                shared_image = await asyncio.to_thread(SharedImage, img)
+            # Chunks are cut in gutters where possible and blank bands are skipped. They are
+            # recognized concurrently; the worker pool bounds how many run at once and
+            # gather keeps the results in top-to-bottom order.
+            chunk_bands = await asyncio.to_thread(plan_chunks, img, self.CHUNK_HEIGHT, self.OVERLAP)
+            chunk_results = await asyncio.gather(*(process_chunk(top, bottom) for top, bottom in chunk_bands))
+        finally:
+            if shared_image:
+                shared_image.close()
+        return join_chunk_lines(chunk_results, chunk_bands, full_height)
+
+    def _recognize_in_process(self, chunk_image: Image) -> dict:
+        # A single in-process engine is not safe to call from several threads.
+        with self._engine_lock:
+            return self.engine.recognize_pil(chunk_image)
+
+    async def recognize(self, img: Image, box, shared_image: SharedImage | None) -> dict:
+        if shared_image is None:
+            # recognize_pil blocks, keep it off the event loop.
+            return await asyncio.to_thread(self._recognize_in_process, img.crop(box))
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, _recognize_shared_chunk, shared_image.shm.name, shared_image.size, box
+        )
 
-    def transform(self, result, image_size) -> list[Bubble]:
+    def transform(self, result, image_size) -> list[OcrLine]:
         if not result or not result.get("lines"):
             return []
 
@@ -125,38 +334,63 @@ class OneOCR(Engine):
                 else 0.95
             )
 
-            bubble = Bubble(
+            output_json.append(OcrLine(
                 text=text,
-                tightBoundingBox=BoundingBox(
-                    x=x_min / image_width,
-                    y=y_min / image_height,
-                    width=width / image_width,
-                    height=height / image_height,
-                ),
+                x=x_min / image_width,
+                y=y_min / image_height,
+                width=width / image_width,
+                height=height / image_height,
                 orientation=snapped_angle,
                 font_size=0.04,
                 confidence=avg_confidence,
-            )
-            output_json.append(bubble)
+            ))
 
         return output_json
 
 
 class GoogleLens(Engine):
+    name = "lens"
+    # Like Chrome, chrome-lens-py shrinks images over this many pixels to fit in a
+    # square of this size before uploading them.
+    MAX_UPLOAD_AREA = 1_500_000
+    MAX_UPLOAD_SIDE = 1600
+
     def __init__(self):
         self.engine = chrome_lens_py.LensAPI()
+        # chrome-lens-py encodes every upload inside its coroutine without yielding, so
+        # its calls run on a loop of their own rather than on the server's.
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="lens-loop", daemon=True).start()
+
+    @classmethod
+    def useful_width(cls, width, height):
+        if width * height <= cls.MAX_UPLOAD_AREA or max(width, height) <= cls.MAX_UPLOAD_SIDE:
+            return None
+        return math.ceil(width * min(cls.MAX_UPLOAD_SIDE / width, cls.MAX_UPLOAD_SIDE / height))
+
+    @classmethod
+    def fit_for_upload(cls, img: Image) -> Image:
+        """Shrinks `img` to the size chrome-lens-py would upload it at, so the library
+        finds nothing left to resize."""
+        width, height = img.size
+        if width * height > cls.MAX_UPLOAD_AREA and max(width, height) > cls.MAX_UPLOAD_SIDE:
+            scale = min(cls.MAX_UPLOAD_SIDE / width, cls.MAX_UPLOAD_SIDE / height)
+            img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), PILImage.Resampling.LANCZOS)
+        return img if img.mode == "RGB" else img.convert("RGB")
 
     async def ocr(self, img):
-        result = await self.engine.process_image(
-            image_path=img, ocr_language="ja", output_format="lines"
-        )
+        # The resize is most of the library's CPU work and runs in parallel in threads.
+        img = await asyncio.to_thread(self.fit_for_upload, img)
+        result = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            self.engine.process_image(image_path=img, ocr_language="ja", output_format="lines"), self.loop
+        ))
         return self.transform(result)
 
-    def transform(self, result: dict) -> list[Bubble]:
+    def transform(self, result: dict) -> list[OcrLine]:
         if not result.get("word_data"):
             return []
 
-        output_json: list[Bubble] = []
+        output_json: list[OcrLine] = []
         lines: list[dict] = result["line_blocks"]
 
         for line in lines:
@@ -176,26 +410,22 @@ class GoogleLens(Engine):
             # example: 90.0 + 6.5 = 96.5, or rotated 6.5 degrees clockwise from vertical
             actual_angle = snapped_angle + angle_deg
 
-            bubble = Bubble(
+            output_json.append(OcrLine(
                 text=text.replace("･･･", "…"),
-                tightBoundingBox=BoundingBox(
-                    x=center_x - width / 2,
-                    y=center_y - height / 2,
-                    width=width,
-                    height=height,
-                ),
+                x=center_x - width / 2,
+                y=center_y - height / 2,
+                width=width,
+                height=height,
                 orientation=round(actual_angle, 1),
                 font_size=0.04,
                 confidence=0.98,  # Assuming a default confidence value
-            )
-            output_json.append(bubble)
-            # print(json.dumps(bubble, indent=2, ensure_ascii=False))
+            ))
 
         return output_json
 
     # just in case we want to parse it ourselves
-    def raw_transform(self, result: dict) -> list[Bubble]:
-        output_json: list[Bubble] = []
+    def raw_transform(self, result: dict) -> list[OcrLine]:
+        output_json: list[OcrLine] = []
         response: LensOverlayObjectsResponse = result["raw_response_objects"]
 
         for paragraph in response.text.text_layout.paragraphs:
@@ -217,40 +447,154 @@ class GoogleLens(Engine):
                 height = bounding_box.height
                 rotation_z = bounding_box.rotation_z
 
-                bubble = Bubble(
+                output_json.append(OcrLine(
                     text=line_text,
-                    tightBoundingBox=BoundingBox(
-                        x=center_x - width / 2,
-                        y=center_y - height / 2,
-                        width=width,
-                        height=height,
-                    ),
+                    x=center_x - width / 2,
+                    y=center_y - height / 2,
+                    width=width,
+                    height=height,
                     orientation=round(rotation_z * (180 / pi), 1),
                     font_size=0.04,
                     confidence=0.98,
-                )
-                output_json.append(bubble)
+                ))
 
         return output_json
 
 
 # TODO: get a mac
 class AppleVision(Engine):
+    name = "applevision"
+
     def __init__(self):
         print("AppleVision is not implemented yet")
         self.engine = object()
 
-    async def ocr(self, img: Image) -> list[Bubble]:
+    async def ocr(self, img: Image) -> list[OcrLine]:
         print("AppleVision is not implemented yet")
         return []
 
 
-def initialize_engine(engine_name: str) -> Engine:
+class StubEngine(Engine):
+    """Stand-in engine for load tests. Every call waits `latency` seconds, like a
+    remote engine would, and returns `lines` lines laid out in a grid of columns.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, lines: int = 20):
+        self.latency = float(latency)
+        self.line_count = int(lines)
+
+    async def ocr(self, img: Image) -> list[OcrLine]:
+        await asyncio.sleep(self.latency)
+        columns = max(math.ceil(math.sqrt(self.line_count)), 1)
+        rows = max(math.ceil(self.line_count / columns), 1)
+        return [
+            OcrLine(
+                text=f"stub {index}",
+                x=1 - (index % columns + 0.7) / columns,
+                y=(index // columns + 0.1) / rows,
+                width=0.4 / columns,
+                height=0.8 / rows,
+                orientation=90.0,
+                font_size=0.04,
+                confidence=0.95,
+            )
+            for index in range(self.line_count)
+        ]
+
+
+class RecordReplayEngine(Engine):
+    """Records another engine's output, or replays recorded output without it.
+
+    In "record" mode every call goes to `engine` and its lines are saved under
+    `path`, one JSON file of Bubbles per image, named after the image's hash. In
+    "replay" mode those files are served instead, after waiting `latency` seconds,
+    and an image that was never recorded is an error. Images are decoded as for
+    the recorded engine, `decode_like` when replaying, so the hashes match.
+    """
+
+    MODES = ("record", "replay")
+
+    def __init__(self, mode: str, path: str = "ocr-recordings", engine: Engine | None = None, latency: float = 0.0,
+                 decode_like: type[Engine] | None = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid record/replay mode: {mode}")
+        if mode == "record" and engine is None:
+            raise ValueError("Record mode needs an engine to record")
+        self.mode = mode
+        self.path = path
+        self.engine = engine
+        self.latency = float(latency)
+        if engine is not None:
+            self.name = engine.name
+            self.max_concurrency = engine.max_concurrency
+        else:
+            self.name = "replay"
+        self.decode_like = type(engine) if engine is not None else decode_like or GoogleLens
+        self.image_modes = self.decode_like.image_modes
+        os.makedirs(path, exist_ok=True)
+
+    def useful_width(self, width, height):
+        return self.decode_like.useful_width(width, height)
+
+    @staticmethod
+    def image_hash(img: Image) -> str:
+        digest = hashlib.sha256(f"{img.mode} {img.width}x{img.height}".encode())
+        digest.update(img.tobytes())
+        return digest.hexdigest()
+
+    def _recording_path(self, image_hash: str) -> str:
+        return os.path.join(self.path, f"{image_hash}.json")
+
+    def _save(self, image_hash: str, bubbles: list[Bubble]):
+        # Write then rename, so a replay never reads a half-written recording.
+        target = self._recording_path(image_hash)
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(bubbles, f, ensure_ascii=False)
+        os.replace(target + ".tmp", target)
+
+    def _load(self, image_hash: str) -> list[Bubble]:
+        try:
+            with open(self._recording_path(image_hash), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise LookupError(f"No recording for image {image_hash}") from None
+
+    async def ocr(self, img: Image) -> list[OcrLine]:
+        image_hash = await asyncio.to_thread(self.image_hash, img)
+        if self.mode == "replay":
+            bubbles = await asyncio.to_thread(self._load, image_hash)
+            await asyncio.sleep(self.latency)
+            return [OcrLine.from_bubble(bubble) for bubble in bubbles]
+
+        lines = await self.engine.ocr(img)
+        await asyncio.to_thread(self._save, image_hash, [line.to_bubble() for line in lines])
+        return lines
+
+
+# Engines by name, for replaying their recordings.
+ENGINE_CLASSES = {engine.name: engine for engine in (GoogleLens, OneOCR, StubEngine)}
+
+
+def initialize_engine(engine_name: str, workers: int | None = None, options: dict[str, str] | None = None) -> Engine:
     engine_name = engine_name.strip().lower()
 
     if engine_name == "lens":
         return GoogleLens()
     elif engine_name == "oneocr":
-        return OneOCR()
+        return OneOCR(workers)
+    elif engine_name == "stub":
+        return StubEngine(**(options or {}))
+    elif engine_name == "record":
+        options = dict(options or {})
+        recorded_engine = initialize_engine(options.pop("engine", "lens"), workers)
+        return RecordReplayEngine("record", engine=recorded_engine, **options)
+    elif engine_name == "replay":
+        options = dict(options or {})
+        replayed_name = options.pop("engine", "lens")
+        if (decode_like := ENGINE_CLASSES.get(replayed_name)) is None:
+            raise ValueError(f"Invalid engine to replay: {replayed_name}")
+        return RecordReplayEngine("replay", decode_like=decode_like, **options)
     else:
         raise ValueError(f"Invalid engine: {engine_name}")
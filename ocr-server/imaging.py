@@ -0,0 +1,162 @@
+import io
+import math
+from typing import Callable
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+# A row whose darkest and brightest pixels differ by no more than this is blank.
+BLANK_ROW_TOLERANCE = 16
+# Minimum run of blank rows treated as a gutter between panels.
+MIN_GUTTER_HEIGHT = 8
+# Rows kept around content so glyphs touching a gutter are not clipped.
+CHUNK_PADDING = 4
+# Bands further apart than this are never packed into one chunk, so tall blank
+# regions are not sent to the engine.
+MAX_PACKED_GUTTER = 4 * MIN_GUTTER_HEIGHT
+
+
+def _row_spread(img: Image) -> np.ndarray:
+    gray = np.asarray(img.convert("L"))
+    return gray.max(axis=1).astype(np.int16) - gray.min(axis=1)
+
+
+def find_content_bands(row_spread: np.ndarray) -> list[tuple[int, int]]:
+    """Returns the `[top, bottom)` row ranges that contain something other than blank
+    gutters. Blank runs shorter than MIN_GUTTER_HEIGHT stay part of the content."""
+    has_content = np.concatenate(([False], row_spread > BLANK_ROW_TOLERANCE, [False]))
+    edges = np.flatnonzero(np.diff(has_content.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) == 0:
+        return []
+
+    is_gutter = (starts[1:] - ends[:-1]) >= MIN_GUTTER_HEIGHT
+    band_starts = starts[np.concatenate(([True], is_gutter))]
+    band_ends = ends[np.concatenate((is_gutter, [True]))]
+    return list(zip(band_starts.tolist(), band_ends.tolist()))
+
+
+def _split_tall_band(row_spread, top, bottom, max_height, overlap):
+    """Cuts a band without gutters at its quietest row in the lower half of each
+    window, overlapping the pieces so a line on the cut is seen whole at least once."""
+    pieces = []
+    while bottom - top > max_height:
+        window = row_spread[top + max_height // 2 : top + max_height]
+        cut = top + max_height // 2 + int(np.argmin(window))
+        pieces.append((top, cut))
+        top = max(cut - overlap, top + 1)
+    pieces.append((top, bottom))
+    return pieces
+
+
+def plan_chunks(img: Image, max_height: int, overlap: int = 0) -> list[tuple[int, int]]:
+    """Plans the `[top, bottom)` row ranges to send to an OCR engine for a tall image.
+
+    Chunks are cut in the gutters between panels, blank regions are dropped entirely,
+    and each chunk is at most about `max_height` rows tall. Bands are only packed into
+    one chunk across gutters of up to MAX_PACKED_GUTTER rows. Only bands with no gutter
+    taller than `max_height` are cut through content, with `overlap` rows of overlap.
+    """
+    full_height = img.height
+    row_spread = _row_spread(img)
+
+    chunks = []
+    current = None
+    for top, bottom in find_content_bands(row_spread):
+        top = max(top - CHUNK_PADDING, 0)
+        bottom = min(bottom + CHUNK_PADDING, full_height)
+        if current and top - current[1] <= MAX_PACKED_GUTTER and bottom - current[0] <= max_height:
+            current = (current[0], bottom)
+            continue
+        if current:
+            chunks.append(current)
+        if bottom - top > max_height:
+            pieces = _split_tall_band(row_spread, top, bottom, max_height, overlap)
+            chunks.extend(pieces[:-1])
+            current = pieces[-1]
+        else:
+            current = (top, bottom)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+# Modes Image.reduce averages correctly. Palette indices and bilevel pixels cannot be
+# averaged, so images in other modes are converted before they are reduced.
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr", "I", "F")
+# Rows of a palette or bilevel image converted at a time while reducing it.
+CONVERT_STRIP_HEIGHT = 1024
+
+
+def _reduce(img: Image, factor: int, mode: str) -> Image:
+    """`img` shrunk by `factor` in `mode`. Images reduce cannot average are converted a
+    strip of rows at a time, so they are never held at full size in the wider mode."""
+    if img.mode in REDUCIBLE_MODES:
+        reduced = img.reduce(factor)
+        return reduced if reduced.mode == mode else reduced.convert(mode)
+    width, height = img.size
+    reduced = PILImage.new(mode, (math.ceil(width / factor), math.ceil(height / factor)))
+    strip_height = factor * max(CONVERT_STRIP_HEIGHT // factor, 1)
+    for top in range(0, height, strip_height):
+        strip = img.crop((0, top, width, min(top + strip_height, height)))
+        reduced.paste(strip.convert(mode).reduce(factor), (0, top // factor))
+    return reduced
+
+
+def decode_image(image_bytes: bytes, modes: tuple[str, ...] = ("RGB",),
+                 min_width: Callable[[int, int], int | None] | None = None,
+                 max_decoded_pixels: int | None = None,
+                 max_unscaled_pixels: int | None = None) -> tuple[Image, tuple[int, int], int]:
+    """Decodes an image at the smallest whole fraction of its size that is still at
+    least `min_width(width, height)` wide and has at most `max_decoded_pixels`
+    pixels. Returns the image, its full size and the factor it was shrunk by.
+
+    JPEGs are scaled while decoding (by 1/2, 1/4 or 1/8), so they never take more
+    than `max_decoded_pixels` in memory. Other formats can only be reduced after a
+    full size decode and are refused over `max_unscaled_pixels`. Images in one of
+    `modes` are kept as they are, others are converted to RGB after reducing them.
+    Images over PIL.Image.MAX_IMAGE_PIXELS are refused from their header alone.
+    """
+    try:
+        img = PILImage.open(io.BytesIO(image_bytes))
+    except (PILImage.DecompressionBombError, PILImage.DecompressionBombWarning) as e:
+        raise ImageTooLargeError(str(e)) from None
+    width, height = img.size
+    if img.format != "JPEG" and max_unscaled_pixels is not None and width * height > max_unscaled_pixels:
+        raise ImageTooLargeError(
+            f"Image size ({width * height} pixels) exceeds limit of {max_unscaled_pixels} pixels for {img.format} images."
+        )
+
+    # The pixel limit wins over the minimum width.
+    width_factor = 1
+    if min_width is not None and (narrowest := min_width(width, height)):
+        width_factor = max(width // narrowest, 1)
+    pixels_factor = 1
+    if max_decoded_pixels is not None and width * height > max_decoded_pixels:
+        pixels_factor = math.ceil(math.sqrt(width * height / max_decoded_pixels))
+
+    shrunk_by = 1
+    if max(width_factor, pixels_factor) > 1 and img.format == "JPEG":
+        # The width only asks for a scale that does not shrink by more than its factor.
+        # The pixel limit is rounded up to a scale JPEG decodes at, so it holds while decoding.
+        draft_factor = width_factor
+        if pixels_factor > width_factor:
+            draft_factor = 2 ** math.ceil(math.log2(pixels_factor))
+        draft = img.draft(None, (math.ceil(width / draft_factor), math.ceil(height / draft_factor)))
+        if draft is not None:
+            shrunk_by = round(width / draft[1][2])
+
+    mode = img.mode if img.mode in modes else "RGB"
+    if (remaining := max(width_factor // shrunk_by, math.ceil(pixels_factor / shrunk_by))) > 1:
+        img = _reduce(img, remaining, mode)
+        shrunk_by *= remaining
+    elif img.mode != mode:
+        img = img.convert(mode)
+    else:
+        img.load()
+    return img, (width, height), shrunk_by
@@ -0,0 +1,218 @@
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """A chapter to pre-process. Pages are `base_url` followed by the page index."""
+
+    def __init__(self, job_id: str, base_url: str, context: str, user: str | None = None,
+                 password: str | None = None, created_at: float | None = None, page_count: int | None = None):
+        self.id = job_id
+        self.base_url = base_url
+        self.context = context
+        self.user = user
+        self.password = password
+        # Given by the client, or None until the job finds the chapter length by probing.
+        self.page_count = page_count
+        self.state = "queued"
+        self.created_at = created_at or time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.error: str | None = None
+        # Progress, updated by the job as it goes.
+        self.pages_done = 0
+        self.pages_cached = 0
+        self.errors = 0
+        self.cancel_requested = False
+        self._cancel_lock = threading.Lock()
+        self._on_cancel: Callable[[], None] | None = None
+
+    def on_cancel(self, callback: Callable[[], None] | None) -> None:
+        """Sets the function that stops the running job. It is called from the thread
+        that cancels the job, right away if that already happened."""
+        with self._cancel_lock:
+            self._on_cancel = callback
+            if callback is not None and self.cancel_requested:
+                callback()
+
+    def request_cancel(self) -> None:
+        with self._cancel_lock:
+            self.cancel_requested = True
+            if self._on_cancel is not None:
+                self._on_cancel()
+
+    def eta(self) -> float | None:
+        """Seconds left at the pace so far, while running a chapter of known length."""
+        handled = self.pages_done + self.pages_cached + self.errors
+        if self.state != "running" or self.page_count is None or not handled:
+            return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / handled * max(self.page_count - handled, 0), 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "base_url": self.base_url,
+            "context": self.context,
+            "page_count": self.page_count,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "pages_done": self.pages_done,
+            "pages_cached": self.pages_cached,
+            "errors": self.errors,
+            "eta_seconds": self.eta(),
+            "cancel_requested": self.cancel_requested,
+        }
+
+
+class JobQueue:
+    """Runs chapter jobs on a fixed pool of worker threads.
+
+    A chapter is queued at most once: submitting a `base_url` that is already queued
+    or running returns the existing job. Queued and running jobs are stored in SQLite
+    and queued again by `start`, so a restart does not lose them. Jobs that need
+    credentials are the exception: passwords are never written to disk, so those
+    jobs are kept in memory only and a restart drops them.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            base_url TEXT NOT NULL,
+            context TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            page_count INTEGER
+        );
+    """
+
+    def __init__(self, path: str, run_job: Callable[[Job], None], workers: int = 2,
+                 max_pending: int = 100, history: int = 50):
+        self.path = path
+        self.run_job = run_job
+        self.workers = max(workers, 1)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[Job] = queue.Queue()
+        self._active: dict[str, Job] = {}
+        self._finished: deque[Job] = deque(maxlen=history)
+        self._started = False
+        # Job changes are rare, so one connection behind the lock is enough.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if "page_count" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN page_count INTEGER")
+            # Earlier versions stored credentials with the job; those jobs are dropped.
+            forget_credentials = "password" in columns and self._conn.execute(
+                "DELETE FROM jobs WHERE user IS NOT NULL OR password IS NOT NULL"
+            ).rowcount
+        if forget_credentials:
+            self._conn.execute("VACUUM")
+
+    def start(self) -> int:
+        """Queues the jobs left over from the last run and starts the workers. Returns
+        how many jobs were restored."""
+        with self._lock:
+            if self._started:
+                return 0
+            self._started = True
+            rows = self._conn.execute(
+                "SELECT id, base_url, context, created_at, page_count FROM jobs ORDER BY created_at"
+            ).fetchall()
+            for job_id, base_url, context, created_at, page_count in rows:
+                job = Job(job_id, base_url, context, created_at=created_at, page_count=page_count)
+                self._active[job.base_url] = job
+                self._queue.put(job)
+        for number in range(self.workers):
+            threading.Thread(target=self._work, name=f"preprocess-worker-{number}", daemon=True).start()
+        return len(rows)
+
+    def submit(self, base_url: str, context: str, user: str | None = None,
+               password: str | None = None, page_count: int | None = None) -> tuple[Job, bool]:
+        """Returns the job for `base_url` and whether it was newly queued."""
+        with self._lock:
+            if (job := self._active.get(base_url)) is not None:
+                return job, False
+            if sum(1 for job in self._active.values() if job.state == "queued") >= self.max_pending:
+                raise JobQueueFull(f"{self.max_pending} chapters are already waiting")
+            job = Job(uuid.uuid4().hex[:12], base_url, context, user, password, page_count=page_count)
+            if not (job.user or job.password):
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO jobs (id, base_url, context, created_at, page_count) VALUES (?, ?, ?, ?, ?)",
+                        (job.id, job.base_url, job.context, job.created_at, job.page_count),
+                    )
+            self._active[base_url] = job
+            self._queue.put(job)
+            return job, True
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancels a queued or running job. A running job is stopped by the function it
+        registered with `Job.on_cancel`. Returns None for an unknown job id."""
+        with self._lock:
+            job = next((job for job in self._active.values() if job.id == job_id), None)
+            if job is None:
+                return next((job for job in self._finished if job.id == job_id), None)
+            if job.state == "queued":
+                # The worker that picks it up skips it.
+                job.cancel_requested = True
+                self._finish(job, "cancelled")
+            else:
+                job.request_cancel()
+            return job
+
+    def set_page_count(self, job: Job, page_count: int | None) -> None:
+        """Records the chapter length a job found, so a restored job need not probe it again."""
+        with self._lock:
+            job.page_count = page_count
+            with self._conn:
+                self._conn.execute("UPDATE jobs SET page_count = ? WHERE id = ?", (page_count, job.id))
+
+    def jobs(self) -> list[Job]:
+        """Queued and running jobs, then recently finished ones, newest first."""
+        with self._lock:
+            return list(self._active.values()) + list(reversed(self._finished))
+
+    def counts(self) -> dict:
+        with self._lock:
+            running = sum(1 for job in self._active.values() if job.state == "running")
+            return {"queued": len(self._active) - running, "running": running}
+
+    def _finish(self, job: Job, state: str, error: str | None = None):
+        # Called with the lock held.
+        job.state = state
+        job.error = error
+        job.finished_at = time.time()
+        del self._active[job.base_url]
+        self._finished.append(job)
+        with self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.state == "cancelled":
+                    continue
+                job.state = "running"
+                job.started_at = time.time()
+            try:
+                self.run_job(job)
+                state, error = ("cancelled" if job.cancel_requested else "done"), None
+            except Exception as e:
+                state, error = "failed", str(e)
+            with self._lock:
+                self._finish(job, state, error)
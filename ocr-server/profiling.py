@@ -0,0 +1,83 @@
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+
+
+class _CapturedStats:
+    """Hands already collected stats to `pstats.Stats`, which only loads files or
+    profilers."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class RequestProfiler:
+    """Captures one cProfile profile spanning the next N requests.
+
+    Since Python 3.12 cProfile hooks into sys.monitoring, so one profiler sees the
+    code of every thread and event loop, not just the one that enabled it. Only one
+    capture can run at a time, and the latest finished profile is kept for download.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profile: cProfile.Profile | None = None
+        self._remaining = 0
+        self._requested = 0
+        self._stats: dict | None = None
+
+    def start(self, requests: int) -> None:
+        if requests < 1:
+            raise ValueError("requests must be at least 1")
+        with self._lock:
+            if self._profile is not None:
+                raise RuntimeError("A capture is already running")
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # Another profiler, e.g. one attached by a debugger, is active.
+                raise RuntimeError(str(e)) from None
+            self._profile = profile
+            self._remaining = self._requested = requests
+
+    def request_finished(self) -> None:
+        with self._lock:
+            if self._profile is None:
+                return
+            self._remaining -= 1
+            if self._remaining > 0:
+                return
+            self._profile.disable()
+            self._profile.create_stats()
+            self._stats = self._profile.stats
+            self._profile = None
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "capturing": self._profile is not None,
+                "requests": self._requested,
+                "remaining_requests": self._remaining if self._profile is not None else 0,
+                "profile_available": self._stats is not None,
+            }
+
+    def dump(self) -> bytes | None:
+        """The last finished profile in the format written by `cProfile.Profile.dump_stats`,
+        readable with `pstats` or tools such as snakeviz."""
+        with self._lock:
+            return marshal.dumps(self._stats) if self._stats is not None else None
+
+    def summary(self, limit: int = 40) -> str | None:
+        with self._lock:
+            stats = self._stats
+        if stats is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(_CapturedStats(stats), stream=output).sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
@@ -6,29 +6,47 @@
 # TODO: Save context to cache file <-- DONE
 
 import argparse
+import asyncio
+import atexit
 import base64
-import io
+import concurrent.futures
+import contextvars
+import hashlib
 import json
+import math
 import os
 import threading
 import traceback
+import warnings
 import time
-import requests
-from urllib.parse import quote
-from collections import defaultdict
+import itertools
+from collections import defaultdict, deque
+from contextlib import aclosing, contextmanager
 
 import aiohttp
-from engines import Engine, initialize_engine
-from flask import Flask, jsonify, request, send_file
+from aiohttp import web
+from cache import LRUCache, OcrCache, initialize_cache_store, migrate_legacy_json, normalize_cache_entry
+from engines import Engine, OcrLine, initialize_engine, join_chunk_lines
+from imaging import ImageTooLargeError, decode_image, plan_chunks
+from jobs import Job, JobQueue, JobQueueFull
+from metrics import METRICS_CONTENT_TYPE, Counter, CounterFunction, Gauge, Histogram, render_metrics
+from profiling import RequestProfiler
+from flask import Flask, Response, jsonify, request
+import numpy as np
 from PIL import Image
 from waitress import serve
 
 # region Config
 IP_ADDRESS = "0.0.0.0"
 PORT = 3000
-CACHE_FILE_PATH = os.path.join(os.getcwd(), "ocr-cache.json")
+CACHE_FILE_PATH = os.path.join(os.getcwd(), "ocr-cache.db")
+LEGACY_CACHE_FILE_PATH = os.path.join(os.getcwd(), "ocr-cache.json")
 UPLOAD_FOLDER = "uploads"
 IMAGE_CACHE_FOLDER = "image_cache"
+# Bounds of the in-memory tier of the OCR cache; evicted entries are read back
+# from the cache database. 0 disables a bound.
+CACHE_MEMORY_MAX_ENTRIES = 2000
+CACHE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
 AUTO_MERGE_CONFIG = {
     "enabled": True,
     "dist_k": 1.2,
@@ -40,23 +58,140 @@ AUTO_MERGE_CONFIG = {
     "mixed_min_overlap_ratio": 0.5,
     "add_space_on_merge": False,
 }
+# Query arguments of /ocr that override AUTO_MERGE_CONFIG for a single request.
+# Every other config key can be passed under its own name.
+MERGE_QUERY_ALIASES = {"auto_merge": "enabled"}
+MERGE_MEMO_MAX_ENTRIES = 512
+# Merges of at least this many lines test line pairs with NumPy instead of a
+# Python double loop; below it the array setup costs more than it saves.
+NUMPY_MERGE_MIN_LINES = 16
+# Shared connection pool used to download images.
+HTTP_POOL_MAX_CONNECTIONS = 100
+HTTP_POOL_MAX_CONNECTIONS_PER_HOST = 16
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_TOTAL_TIMEOUT = 45
+# Chapter pre-processing jobs: how many run at once, how many may wait, and where
+# waiting jobs are kept across restarts.
+JOBS_FILE_PATH = os.path.join(os.getcwd(), "ocr-jobs.db")
+PREPROCESS_WORKERS = 2
+PREPROCESS_MAX_PENDING_JOBS = 100
+# Images of one /ocr/batch request that are recognized at once, and the most
+# images such a request may list.
+OCR_BATCH_CONCURRENCY = 4
+OCR_BATCH_MAX_URLS = 1000
+# How often a batch checks whether its client is still connected.
+BATCH_DISCONNECT_POLL_SECONDS = 0.25
+# Tall images are recognized in chunks of at most this many rows. Chunks that have
+# to be cut through content rather than in a gutter overlap by CHUNK_OVERLAP rows.
+MAX_CHUNK_HEIGHT = 3000
+CHUNK_OVERLAP = 150
+# Images over MAX_IMAGE_PIXELS are refused. Larger ones than MAX_DECODED_PIXELS are
+# shrunk: JPEGs while decoding, so they never take more memory than that, other
+# formats only after a full size decode, so those are refused over
+# MAX_UNSCALED_DECODE_PIXELS.
+MAX_IMAGE_PIXELS = 400_000_000
+MAX_DECODED_PIXELS = 60_000_000
+MAX_UNSCALED_DECODE_PIXELS = 2 * MAX_DECODED_PIXELS
+# Pages a job downloads ahead of the one being recognized.
+PREPROCESS_PREFETCH_PAGES = 4
+# Chapter length probing gives up beyond this many pages.
+PREPROCESS_PROBE_MAX_PAGES = 2048
+# Cache entries read from the store for each chunk of /export-cache.
+EXPORT_BATCH_SIZE = 500
 # endregion
 
 # region Setup
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
-Image.MAX_IMAGE_PIXELS = None
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter("error", Image.DecompressionBombWarning)
 
 is_debug_mode = False
-ocr_cache = {}
+ocr_cache: OcrCache
 ocr_requests_processed = 0
 cache_lock = threading.Lock()
-active_job_count = 0
-active_job_lock = threading.Lock()
+job_queue: JobQueue
 ocr_engine: Engine
 # endregion
 
+# region Metrics
+# Exposed at /metrics in the Prometheus text format. Gauges and cache counters are
+# read when the page is rendered, so they are defined before the objects they read.
+
+ocr_stage_seconds = Histogram(
+    "ocr_stage_duration_seconds",
+    "Time spent in each stage of an /ocr request.",
+    ("stage",),
+)
+ocr_request_seconds = Histogram(
+    "ocr_request_duration_seconds",
+    "Time to answer /ocr requests, by whether the result was cached.",
+    ("result",),
+)
+ocr_engine_errors = Counter("ocr_engine_errors_total", "OCR engine calls that raised.", ("engine",))
+preprocess_pages = Counter(
+    "preprocess_pages_total", "Pages handled by chapter pre-processing jobs.", ("result",)
+)
+
+
+def _cache_stat(name):
+    return lambda: ocr_cache.stats()[name]
+
+
+all_metrics = [
+    ocr_stage_seconds,
+    ocr_request_seconds,
+    ocr_engine_errors,
+    preprocess_pages,
+    CounterFunction("ocr_cache_memory_hits_total", "Cache lookups answered from memory.", _cache_stat("memory_hits")),
+    CounterFunction("ocr_cache_disk_hits_total", "Cache lookups answered from the cache database.", _cache_stat("disk_hits")),
+    CounterFunction("ocr_cache_misses_total", "Cache lookups that found nothing.", _cache_stat("misses")),
+    CounterFunction("ocr_cache_evictions_total", "Entries evicted from the memory tier.", _cache_stat("evictions")),
+    Gauge("ocr_cache_entries", "Entries in the OCR cache, not counted in lazy mode.", lambda: ocr_cache.indexed_count()),
+    Gauge("ocr_cache_memory_entries", "Entries held in the memory tier.", _cache_stat("memory_entries")),
+    Gauge("ocr_cache_memory_bytes", "Approximate size of the memory tier.", _cache_stat("memory_approx_bytes")),
+    CounterFunction("ocr_engine_runs_total", "Images recognized by the OCR engine.", lambda: ocr_requests_processed),
+    Gauge("ocr_in_flight_requests", "Distinct images being processed for /ocr.", lambda: ocr_flights.in_flight()),
+    CounterFunction("ocr_coalesced_requests_total", "Requests that joined an in-flight one.", lambda: ocr_flights.coalesced_requests),
+    Gauge("ocr_engine_waiting_calls", "Engine calls waiting for the concurrency bound.", lambda: ocr_engine.waiting_calls),
+    Gauge("ocr_engine_running_calls", "Engine calls running.", lambda: ocr_engine.running_calls),
+    Gauge("preprocess_active_jobs", "Chapter pre-processing jobs running.", lambda: job_queue.counts()["running"]),
+    Gauge("preprocess_queued_jobs", "Chapter pre-processing jobs waiting for a worker.", lambda: job_queue.counts()["queued"]),
+]
+
+# Stage timings of the current /ocr request, sent back in its Server-Timing header.
+request_timings: contextvars.ContextVar[list | None] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed_stage(stage, description=None):
+    """Records the duration of the block in the stage histogram and, inside an /ocr
+    request, in that request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        ocr_stage_seconds.observe(elapsed, stage=stage)
+        if (timings := request_timings.get()) is not None:
+            timings.append((stage, elapsed, description))
+
+
+def format_server_timing(timings):
+    entries = []
+    for name, seconds, description in timings:
+        entry = f"{name};dur={seconds * 1000:.1f}"
+        if description:
+            entry += f';desc="{description}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+request_profiler = RequestProfiler()
+# endregion
+
 
 # region Auto-Merge Logic (Ported from UserScript)
 
@@ -97,140 +232,254 @@ def _median(data):
     return sorted_data[mid]
 
 
-def _group_ocr_data(lines, natural_width, natural_height, config):
-    if not lines or len(lines) < 2 or not natural_width or not natural_height:
-        return [[line] for line in lines]
-
-    CHUNK_MAX_HEIGHT = 3000
-    processed_lines = []
-    for index, line in enumerate(lines):
-        bbox = line["tightBoundingBox"]
-        pixel_top = bbox["y"] * natural_height
-        pixel_bottom = (bbox["y"] + bbox["height"]) * natural_height
-        norm_scale = 1000 / natural_width
-
-        normalized_bbox = {
-            "x": (bbox["x"] * natural_width) * norm_scale,
-            "y": (bbox["y"] * natural_height) * norm_scale,
-            "width": (bbox["width"] * natural_width) * norm_scale,
-            "height": (bbox["height"] * natural_height) * norm_scale,
-        }
-        normalized_bbox["right"] = normalized_bbox["x"] + normalized_bbox["width"]
-        normalized_bbox["bottom"] = normalized_bbox["y"] + normalized_bbox["height"]
-
-        is_vertical = normalized_bbox["width"] <= normalized_bbox["height"]
-        font_size = normalized_bbox["width"] if is_vertical else normalized_bbox["height"]
-
-        processed_lines.append({
-            "original_index": index,
-            "is_vertical": is_vertical,
-            "font_size": font_size,
-            "bbox": normalized_bbox,
-            "pixel_top": pixel_top,
-            "pixel_bottom": pixel_bottom,
-        })
-
-    processed_lines.sort(key=lambda p: p["pixel_top"])
+class _MergeLine:
+    """A line's box in merge space (the image scaled to 1000 units wide)."""
 
-    all_groups = []
-    current_line_index = 0
-    chunks_processed = 0
+    __slots__ = ("index", "is_vertical", "font_size", "x", "y", "width", "height", "right", "bottom")
 
-    while current_line_index < len(processed_lines):
-        chunks_processed += 1
-        chunk_start_index = current_line_index
-        chunk_end_index = len(processed_lines) - 1
+    def __init__(self, index, x, y, width, height):
+        self.index = index
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.right = x + width
+        self.bottom = y + height
+        self.is_vertical = width <= height
+        self.font_size = width if self.is_vertical else height
 
-        if natural_height > CHUNK_MAX_HEIGHT:
-            chunk_top_y = processed_lines[chunk_start_index]["pixel_top"]
-            for i in range(chunk_start_index + 1, len(processed_lines)):
-                if (processed_lines[i]["pixel_bottom"] - chunk_top_y) <= CHUNK_MAX_HEIGHT:
-                    chunk_end_index = i
-                else:
-                    break
 
-        chunk_lines = processed_lines[chunk_start_index : chunk_end_index + 1]
-        uf = UnionFind(len(chunk_lines))
-
-        horizontal_lines = [l for l in chunk_lines if not l["is_vertical"]]
-        vertical_lines = [l for l in chunk_lines if l["is_vertical"]]
+def _is_merge_pair(line_a, line_b, robust_median_h, robust_median_w, config):
+    if line_a.is_vertical != line_b.is_vertical:
+        return False
+    # A box of zero size has no font size to compare; it is never merged.
+    if line_a.font_size <= 0 or line_b.font_size <= 0:
+        return False
 
-        initial_median_h = _median([l["bbox"]["height"] for l in horizontal_lines])
-        initial_median_w = _median([l["bbox"]["width"] for l in vertical_lines])
+    is_a_primary = line_a.font_size >= (robust_median_w if line_a.is_vertical else robust_median_h) * config["min_line_ratio"]
+    is_b_primary = line_b.font_size >= (robust_median_w if line_b.is_vertical else robust_median_h) * config["min_line_ratio"]
+    
+    font_ratio_threshold = config["font_ratio"]
+    if is_a_primary != is_b_primary:
+        font_ratio_threshold = config["font_ratio_for_mixed"]
+    
+    font_ratio = max(line_a.font_size / line_b.font_size, line_b.font_size / line_a.font_size)
+    if font_ratio > font_ratio_threshold:
+        return False
 
-        primary_h = [l for l in horizontal_lines if l["bbox"]["height"] >= initial_median_h * config["min_line_ratio"]]
-        primary_v = [l for l in vertical_lines if l["bbox"]["width"] >= initial_median_w * config["min_line_ratio"]]
-        
-        robust_median_h = _median([l["bbox"]["height"] for l in primary_h]) or initial_median_h or 20
-        robust_median_w = _median([l["bbox"]["width"] for l in primary_v]) or initial_median_w or 20
+    dist_threshold = (robust_median_w if line_a.is_vertical else robust_median_h) * config["dist_k"]
+    
+    if line_a.is_vertical:
+        reading_gap = max(0, max(line_a.x, line_b.x) - min(line_a.right, line_b.right))
+        perp_overlap = max(0, min(line_a.bottom, line_b.bottom) - max(line_a.y, line_b.y))
+    else:
+        reading_gap = max(0, max(line_a.y, line_b.y) - min(line_a.bottom, line_b.bottom))
+        perp_overlap = max(0, min(line_a.right, line_b.right) - max(line_a.x, line_b.x))
 
-        for i in range(len(chunk_lines)):
-            for j in range(i + 1, len(chunk_lines)):
-                line_a, line_b = chunk_lines[i], chunk_lines[j]
-                if line_a["is_vertical"] != line_b["is_vertical"]:
-                    continue
+    smaller_perp_size = min(line_a.height if line_a.is_vertical else line_a.width,
+                            line_b.height if line_b.is_vertical else line_b.width)
 
-                is_a_primary = line_a["font_size"] >= (robust_median_w if line_a["is_vertical"] else robust_median_h) * config["min_line_ratio"]
-                is_b_primary = line_b["font_size"] >= (robust_median_w if line_b["is_vertical"] else robust_median_h) * config["min_line_ratio"]
-                
-                font_ratio_threshold = config["font_ratio"]
-                if is_a_primary != is_b_primary:
-                    font_ratio_threshold = config["font_ratio_for_mixed"]
-                
-                font_ratio = max(line_a["font_size"] / line_b["font_size"], line_b["font_size"] / line_a["font_size"])
-                if font_ratio > font_ratio_threshold:
-                    continue
+    if reading_gap > dist_threshold:
+        return False
+    if smaller_perp_size > 0 and perp_overlap / smaller_perp_size < config["overlap_min"]:
+        return False
+    if is_a_primary != is_b_primary and smaller_perp_size > 0 and (perp_overlap / smaller_perp_size < config["mixed_min_overlap_ratio"]):
+        return False
+    
+    return True
+
+
+def _sweep_pairs(indices, starts, ends):
+    """Pairs of `indices` whose closed [start, end] intervals intersect."""
+    order = sorted(range(len(indices)), key=lambda k: starts[k])
+    for position, a in enumerate(order):
+        for b in order[position + 1 :]:
+            if starts[b] > ends[a]:
+                break
+            i, j = indices[a], indices[b]
+            yield (i, j) if i < j else (j, i)
+
+
+def _sweep_pairs_numpy(indices, starts, ends):
+    order = np.argsort(starts, kind="stable")
+    indices, starts, ends = indices[order], starts[order], ends[order]
+    # Sorted by start, the partners of interval k are k+1 .. stop[k]-1.
+    stop = np.searchsorted(starts, ends, side="right")
+    counts = np.maximum(stop - np.arange(len(starts)) - 1, 0)
+    a = np.repeat(np.arange(len(starts)), counts)
+    b = a + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = indices[a], indices[b]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def _merge_candidate_intervals(lines, robust_median_h, robust_median_w, config):
+    """Maps every line to an interval on one axis such that any pair that can pass
+    `_is_merge_pair` has intersecting intervals. Pairs are the same orientation and
+    within `dist_k * median` of each other along the reading direction, so:
+
+    - horizontal lines use their y extent padded by half that reach, and
+    - vertical lines use their y extent, since with `overlap_min` > 0 they must
+      overlap vertically. Otherwise their x extent padded by half the reach is used.
+
+    Returns (indices, starts, ends) per orientation. Vertical lines of zero height,
+    which would skip the overlap test, also have zero width and never pair.
+    """
+    # Widen a little so float rounding never drops a pair right at the threshold.
+    slack = 1e-6
+    groups = []
+    for vertical in (False, True):
+        reach = (robust_median_w if vertical else robust_median_h) * config["dist_k"] / 2 + slack
+        indices, starts, ends = [], [], []
+        for index, line in enumerate(lines):
+            if line.is_vertical != vertical:
+                continue
+            if not vertical:
+                start, end = line.y - reach, line.bottom + reach
+            elif config["overlap_min"] > 0:
+                start, end = line.y - slack, line.bottom + slack
+            else:
+                start, end = line.x - reach, line.right + reach
+            indices.append(index)
+            starts.append(start)
+            ends.append(end)
+        groups.append((indices, starts, ends))
+    return groups
+
+
+def _merge_candidate_pairs(lines, robust_median_h, robust_median_w, config, use_numpy):
+    groups = _merge_candidate_intervals(lines, robust_median_h, robust_median_w, config)
+    if use_numpy:
+        pair_arrays = [
+            _sweep_pairs_numpy(np.array(indices, dtype=np.intp), np.array(starts), np.array(ends))
+            for indices, starts, ends in groups
+        ]
+        return np.concatenate([pair[0] for pair in pair_arrays]), np.concatenate([pair[1] for pair in pair_arrays])
+
+    return sorted({pair for indices, starts, ends in groups for pair in _sweep_pairs(indices, starts, ends)})
+
+
+def _find_merge_pairs(lines, robust_median_h, robust_median_w, config):
+    for i, j in _merge_candidate_pairs(lines, robust_median_h, robust_median_w, config, use_numpy=False):
+        if _is_merge_pair(lines[i], lines[j], robust_median_h, robust_median_w, config):
+            yield i, j
+
+
+def _find_merge_pairs_numpy(lines, robust_median_h, robust_median_w, config):
+    """Same tests as `_is_merge_pair`, evaluated for all candidate pairs at once."""
+    is_vertical = np.array([l.is_vertical for l in lines])
+    font_size = np.array([l.font_size for l in lines], dtype=float)
+    x = np.array([l.x for l in lines], dtype=float)
+    y = np.array([l.y for l in lines], dtype=float)
+    right = np.array([l.right for l in lines], dtype=float)
+    bottom = np.array([l.bottom for l in lines], dtype=float)
+    perp_size = np.array([l.height if l.is_vertical else l.width for l in lines], dtype=float)
+
+    median_size = np.where(is_vertical, robust_median_w, robust_median_h)
+    is_primary = font_size >= median_size * config["min_line_ratio"]
+
+    i, j = _merge_candidate_pairs(lines, robust_median_h, robust_median_w, config, use_numpy=True)
+    vertical = is_vertical[i]
+
+    is_mixed = is_primary[i] != is_primary[j]
+    font_ratio_threshold = np.where(is_mixed, config["font_ratio_for_mixed"], config["font_ratio"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        font_ratio = np.maximum(font_size[i] / font_size[j], font_size[j] / font_size[i])
+
+    dist_threshold = median_size[i] * config["dist_k"]
+    reading_gap = np.maximum(0, np.where(
+        vertical,
+        np.maximum(x[i], x[j]) - np.minimum(right[i], right[j]),
+        np.maximum(y[i], y[j]) - np.minimum(bottom[i], bottom[j]),
+    ))
+    perp_overlap = np.maximum(0, np.where(
+        vertical,
+        np.minimum(bottom[i], bottom[j]) - np.maximum(y[i], y[j]),
+        np.minimum(right[i], right[j]) - np.maximum(x[i], x[j]),
+    ))
+    smaller_perp_size = np.minimum(perp_size[i], perp_size[j])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overlap_ratio = perp_overlap / smaller_perp_size
+    has_perp_size = smaller_perp_size > 0
+
+    # 0/0 is NaN, which compares false against every threshold, so boxes of zero
+    # size are ruled out explicitly, as `_is_merge_pair` does.
+    linked = (font_size[i] > 0) & (font_size[j] > 0)
+    linked &= ~(font_ratio > font_ratio_threshold)
+    linked &= ~(reading_gap > dist_threshold)
+    linked &= ~(has_perp_size & (overlap_ratio < config["overlap_min"]))
+    linked &= ~(is_mixed & has_perp_size & (overlap_ratio < config["mixed_min_overlap_ratio"]))
+    return zip(i[linked].tolist(), j[linked].tolist())
 
-                dist_threshold = (robust_median_w if line_a["is_vertical"] else robust_median_h) * config["dist_k"]
-                
-                if line_a["is_vertical"]:
-                    reading_gap = max(0, max(line_a["bbox"]["x"], line_b["bbox"]["x"]) - min(line_a["bbox"]["right"], line_b["bbox"]["right"]))
-                    perp_overlap = max(0, min(line_a["bbox"]["bottom"], line_b["bbox"]["bottom"]) - max(line_a["bbox"]["y"], line_b["bbox"]["y"]))
-                else:
-                    reading_gap = max(0, max(line_a["bbox"]["y"], line_b["bbox"]["y"]) - min(line_a["bbox"]["bottom"], line_b["bbox"]["bottom"]))
-                    perp_overlap = max(0, min(line_a["bbox"]["right"], line_b["bbox"]["right"]) - max(line_a["bbox"]["x"], line_b["bbox"]["x"]))
 
-                smaller_perp_size = min(line_a["bbox"]["height"] if line_a["is_vertical"] else line_a["bbox"]["width"],
-                                        line_b["bbox"]["height"] if line_b["is_vertical"] else line_b["bbox"]["width"])
+def _group_ocr_data(lines, natural_width, natural_height, config):
+    if not lines or len(lines) < 2 or not natural_width or not natural_height:
+        return [[line] for line in lines]
 
-                if reading_gap > dist_threshold:
-                    continue
-                if smaller_perp_size > 0 and perp_overlap / smaller_perp_size < config["overlap_min"]:
-                    continue
-                if is_a_primary != is_b_primary and smaller_perp_size > 0 and (perp_overlap / smaller_perp_size < config["mixed_min_overlap_ratio"]):
-                    continue
-                
-                uf.union(i, j)
+    norm_scale = 1000 / natural_width
+    processed_lines = [
+        _MergeLine(
+            index,
+            (line.x * natural_width) * norm_scale,
+            (line.y * natural_height) * norm_scale,
+            (line.width * natural_width) * norm_scale,
+            (line.height * natural_height) * norm_scale,
+        )
+        for index, line in enumerate(lines)
+    ]
+
+    # Only lines within merge reach of each other are compared (see
+    # _merge_candidate_intervals), so the whole image is grouped in one pass, with no
+    # window boundaries that lines could straddle however tall the image is.
+    processed_lines.sort(key=lambda p: p.y)
+    uf = UnionFind(len(processed_lines))
+
+    horizontal_lines = [l for l in processed_lines if not l.is_vertical]
+    vertical_lines = [l for l in processed_lines if l.is_vertical]
+
+    initial_median_h = _median([l.height for l in horizontal_lines])
+    initial_median_w = _median([l.width for l in vertical_lines])
+
+    primary_h = [l for l in horizontal_lines if l.height >= initial_median_h * config["min_line_ratio"]]
+    primary_v = [l for l in vertical_lines if l.width >= initial_median_w * config["min_line_ratio"]]
+
+    robust_median_h = _median([l.height for l in primary_h]) or initial_median_h or 20
+    robust_median_w = _median([l.width for l in primary_v]) or initial_median_w or 20
+
+    if len(processed_lines) >= NUMPY_MERGE_MIN_LINES:
+        link_pairs = _find_merge_pairs_numpy(processed_lines, robust_median_h, robust_median_w, config)
+    else:
+        link_pairs = _find_merge_pairs(processed_lines, robust_median_h, robust_median_w, config)
+    for i, j in link_pairs:
+        uf.union(i, j)
 
-        temp_groups = defaultdict(list)
-        for i in range(len(chunk_lines)):
-            root = uf.find(i)
-            temp_groups[root].append(chunk_lines[i])
+    temp_groups = defaultdict(list)
+    for i in range(len(processed_lines)):
+        root = uf.find(i)
+        temp_groups[root].append(processed_lines[i])
 
-        chunk_final_groups = [
-            [lines[p_line["original_index"]] for p_line in group]
-            for group in temp_groups.values()
-        ]
-        all_groups.extend(chunk_final_groups)
-        current_line_index = chunk_end_index + 1
+    all_groups = [
+        [lines[p_line.index] for p_line in group]
+        for group in temp_groups.values()
+    ]
 
     if is_debug_mode:
-        print(f"[AutoMerge] Grouping finished. Initial: {len(lines)}, Final groups: {len(all_groups)} (in {chunks_processed} chunk(s))")
+        print(f"[AutoMerge] Grouping finished. Initial: {len(lines)}, Final groups: {len(all_groups)}")
     return all_groups
 
 
 def auto_merge_ocr_data(lines, natural_width, natural_height, config):
+    """Merges `OcrLine`s into text blocks and returns them in serialized form."""
     groups = _group_ocr_data(lines, natural_width, natural_height, config)
     final_merged_data = []
 
     for group in groups:
         if len(group) == 1:
-            final_merged_data.append(group[0])
+            final_merged_data.append(group[0].to_bubble())
             continue
 
         # --- ROBUST ORIENTATION DETECTION (THE FIX) ---
         # Determine group orientation by a "majority vote" of the lines inside it.
-        vertical_lines_count = sum(1 for line in group if line["tightBoundingBox"]['height'] > line["tightBoundingBox"]['width'])
+        vertical_lines_count = sum(1 for line in group if line.height > line.width)
         horizontal_lines_count = len(group) - vertical_lines_count
         is_vertical_group = vertical_lines_count > horizontal_lines_count
 
@@ -238,26 +487,19 @@ def auto_merge_ocr_data(lines, natural_width, natural_height, config):
         if is_vertical_group:
             # Sort by the horizontal center of the box (descending for right-to-left)
             # then by the vertical center (ascending for top-to-bottom).
-            group.sort(key=lambda line: (
-                -(line["tightBoundingBox"]["x"] + line["tightBoundingBox"]["width"] / 2), 
-                line["tightBoundingBox"]["y"] + line["tightBoundingBox"]["height"] / 2
-            ))
+            group.sort(key=lambda line: (-(line.x + line.width / 2), line.y + line.height / 2))
         else:
             # Sort by the vertical center, then by the horizontal center.
-            group.sort(key=lambda line: (
-                line["tightBoundingBox"]["y"] + line["tightBoundingBox"]["height"] / 2, 
-                line["tightBoundingBox"]["x"] + line["tightBoundingBox"]["width"] / 2
-            ))
+            group.sort(key=lambda line: (line.y + line.height / 2, line.x + line.width / 2))
         
         join_char = " " if config["add_space_on_merge"] else "\u200b"
-        combined_text = join_char.join([line["text"] for line in group])
+        combined_text = join_char.join([line.text for line in group])
 
         # Calculate final bounding box for the merged group
-        group_bboxes = [line["tightBoundingBox"] for line in group]
-        min_x = min(b["x"] for b in group_bboxes)
-        min_y = min(b["y"] for b in group_bboxes)
-        max_r = max(b["x"] + b["width"] for b in group_bboxes)
-        max_b = max(b["y"] + b["height"] for b in group_bboxes)
+        min_x = min(line.x for line in group)
+        min_y = min(line.y for line in group)
+        max_r = max(line.x + line.width for line in group)
+        max_b = max(line.y + line.height for line in group)
 
         final_merged_data.append({
             "text": combined_text,
@@ -282,26 +524,377 @@ def auto_merge_ocr_data(lines, natural_width, natural_height, config):
 # region Utility
 
 
-def load_cache():
+def load_cache(mode, max_entries=CACHE_MEMORY_MAX_ENTRIES, max_bytes=CACHE_MEMORY_MAX_BYTES):
     global ocr_cache
-    if os.path.exists(CACHE_FILE_PATH):
+    cache_store = initialize_cache_store(CACHE_FILE_PATH)
+    try:
+        migrated = migrate_legacy_json(cache_store, LEGACY_CACHE_FILE_PATH)
+        if migrated:
+            print(f"[Cache] Migrated {migrated} items from {LEGACY_CACHE_FILE_PATH}")
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[Cache] Warning: Could not migrate legacy cache file: {e}")
+
+    start_time = time.perf_counter()
+    ocr_cache = OcrCache(cache_store, mode, max_entries, max_bytes)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    print(f"[Cache] Opened {CACHE_FILE_PATH} in '{mode}' mode ({elapsed_ms:.0f} ms).")
+    if is_debug_mode:
+        print(f"[DEBUG] {len(ocr_cache)} items in cache.")
+
+
+def load_job_queue(workers=PREPROCESS_WORKERS):
+    global job_queue
+    job_queue = JobQueue(JOBS_FILE_PATH, run_chapter_job, workers, PREPROCESS_MAX_PENDING_JOBS)
+
+
+def start_job_queue():
+    # Workers use the shared I/O loop, so they may only start once it runs.
+    if restored := job_queue.start():
+        print(f"[Queue] Resuming {restored} chapter pre-processing job(s) from the last run.")
+
+
+def basic_auth_headers(user, password):
+    if not user:
+        return {}
+    auth_base64 = base64.b64encode(f"{user}:{password or ''}".encode("utf-8")).decode("utf-8")
+    return {"Authorization": f"Basic {auth_base64}"}
+
+
+async def get_cache_entry(key):
+    """Looks `key` up in the cache from a coroutine. Memory hits are answered on the
+    running loop; only reads of the store go to a thread."""
+    if (entry := ocr_cache.get_from_memory(key)) is not None:
+        return entry
+    return await asyncio.to_thread(ocr_cache.get, key)
+
+
+def save_cache_entry(key, entry):
+    if is_debug_mode:
+        print(f"[DEBUG] Saving OCR cache entry for {key}...")
+    ocr_cache.put(key, entry)
+
+
+# endregion
+
+
+# region Shared I/O Loop
+
+
+class SharedIoLoop:
+    """Long-lived event loop on a daemon thread that owns the pooled aiohttp session.
+
+    Flask runs every async view in a throwaway event loop, and an aiohttp session is
+    bound to the loop that created it, so pooled I/O is submitted to this loop
+    instead. Keep-alive connections, DNS and TLS sessions then survive across
+    requests and are shared by interactive OCR and chapter preprocessing.
+    """
+
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        self._session: aiohttp.ClientSession | None = None
+
+    def start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="shared-io-loop", daemon=True).start()
+                atexit.register(self.stop)
+        return self.loop
+
+    def attach(self, loop):
+        """Uses an already running loop, such as the one of the async server, instead
+        of starting a thread of our own."""
+        with self._lock:
+            self.loop = loop
+
+    async def close_session(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def stop(self):
+        if self.loop is None or self._session is None or not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.close_session(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+
+    async def run(self, coro):
+        loop = self.start()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+
+        # Carry the caller's context variables, such as the request's stage timings,
+        # over to the task that runs on the shared loop.
+        context = contextvars.copy_context()
+
+        async def in_caller_context():
+            for var, value in context.items():
+                var.set(value)
+            return await coro
+
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(in_caller_context(), loop))
+
+    def http_session(self):
+        # Only called from coroutines running on self.loop, so no locking is needed.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_MAX_CONNECTIONS,
+                limit_per_host=HTTP_POOL_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+
+io_loop = SharedIoLoop()
+
+
+async def _fetch_image(image_url, headers):
+    async with io_loop.http_session().get(image_url, headers=headers) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def fetch_image(image_url, headers):
+    return await io_loop.run(_fetch_image(image_url, headers))
+
+
+async def _page_exists(image_url, headers):
+    async with io_loop.http_session().head(image_url, headers=headers, allow_redirects=True) as response:
+        if response.status == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+
+async def page_exists(image_url, headers):
+    """Asks for the image with a HEAD request, without downloading it."""
+    return await io_loop.run(_page_exists(image_url, headers))
+
+
+# endregion
+
+
+# region OCR Pipeline
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key. The first caller runs the work and
+    every caller that arrives while it is in flight awaits the same result.
+
+    Under waitress each request runs its own event loop on its own thread, so the
+    shared result is a thread-safe `concurrent.futures.Future`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+        self.coalesced_requests = 0
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    async def run(self, key, work):
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced_requests += 1
+
+        if not is_leader:
+            if is_debug_mode:
+                print(f"[DEBUG] Waiting for in-flight request: {key}")
+            return await asyncio.wrap_future(future)
+
         try:
-            with open(CACHE_FILE_PATH, "r", encoding="utf-8") as f:
-                ocr_cache = json.load(f)
-            print(f"[Cache] Loaded {len(ocr_cache)} items from {CACHE_FILE_PATH}")
-        except json.JSONDecodeError:
-            print("[Cache] Warning: Could not decode JSON. Starting fresh.")
+            result = await work()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+ocr_flights = SingleFlight()
+
+
+def useful_width(width, height):
+    # Chunks of tall images are sent at many sizes, so those keep their full width.
+    if height > MAX_CHUNK_HEIGHT:
+        return None
+    return ocr_engine.useful_width(width, height)
+
+
+def decode_for_engine(image_bytes):
+    return decode_image(image_bytes, ocr_engine.image_modes, useful_width, MAX_DECODED_PIXELS, MAX_UNSCALED_DECODE_PIXELS)
+
+
+async def run_engine(img, description=None):
+    with timed_stage("engine", description):
+        try:
+            return await ocr_engine.bounded_ocr(img)
+        except Exception:
+            ocr_engine_errors.inc(engine=ocr_engine.name)
+            raise
+
+
+# Set by streamed /ocr requests, which pass each chunk of a tall image on as soon as
+# it is recognized. Called on the shared I/O loop with the chunk index, the chunk
+# count, the chunk's raw lines in full-image coordinates and the image size.
+chunk_listener: contextvars.ContextVar = contextvars.ContextVar("chunk_listener", default=None)
+
+
+async def recognize_image(image_bytes, context):
+    global ocr_requests_processed
+    with timed_stage("decode"):
+        image, (original_width, original_height), shrunk_by = await asyncio.to_thread(decode_for_engine, image_bytes)
+
+    full_width, full_height = image.size
+    if shrunk_by > 1:
+        print(f"[OCR] [{context}] Decoded at 1/{shrunk_by} size ({full_width}x{full_height}).")
+
+    def to_original_size(lines):
+        # A shrunk image's last row and column stand for fewer than `shrunk_by` pixels,
+        # so it covers slightly more than the original in normalized coordinates.
+        if shrunk_by > 1:
+            scale_x = full_width * shrunk_by / original_width
+            scale_y = full_height * shrunk_by / original_height
+            for line in lines:
+                line.x, line.width = line.x * scale_x, line.width * scale_x
+                line.y, line.height = line.y * scale_y, line.height * scale_y
+        return lines
+
+    async def recognize_chunk(index, y_offset, y_bottom):
+        box = (0, y_offset, full_width, y_bottom)
+        chunk_image = image.crop(box)
+        chunk_width, chunk_height = chunk_image.size
+        print(f"[OCR] [{context}] Processing chunk at y={y_offset} (size: {chunk_width}x{chunk_height})")
+
+        chunk_lines = await run_engine(chunk_image, f"chunk {index + 1}, rows {y_offset}-{y_bottom}")
+        for line in chunk_lines:
+            # Chunks span the full width, only y and height need remapping.
+            line.y = (line.y * chunk_height + y_offset) / full_height
+            line.height = line.height * chunk_height / full_height
+        to_original_size(chunk_lines)
+        if (listener := chunk_listener.get()) is not None:
+            try:
+                listener(index, len(chunk_bands), [line.to_bubble() for line in chunk_lines], original_width, original_height)
+            except Exception as e:
+                # A streaming client is only a spectator, the image is still recognized and cached.
+                print(f"[OCR] [{context}] Chunk listener failed: {e}")
+        return chunk_lines
+
+    async def recognize_all_chunks():
+        # Runs on the shared I/O loop, where the engine's concurrency bound lives.
+        # gather returns the chunks in top-to-bottom order whatever order they finish in.
+        return await asyncio.gather(
+            *(recognize_chunk(index, top, bottom) for index, (top, bottom) in enumerate(chunk_bands))
+        )
+
+    if full_height > MAX_CHUNK_HEIGHT:
+        # Cut in the gutters between panels and skip blank bands altogether.
+        chunk_bands = await asyncio.to_thread(plan_chunks, image, MAX_CHUNK_HEIGHT, CHUNK_OVERLAP)
+        print(f"[OCR] [{context}] Image is tall ({full_height}px). Processing in {len(chunk_bands)} chunks.")
+        lines = join_chunk_lines(await io_loop.run(recognize_all_chunks()), chunk_bands, full_height)
     else:
-        print("[Cache] No cache file found. Starting fresh.")
+        lines = to_original_size(await io_loop.run(run_engine(image)))
 
+    with cache_lock:
+        ocr_requests_processed += 1
+    return {
+        "engine": ocr_engine.name,
+        "width": original_width,
+        "height": original_height,
+        "raw": [line.to_bubble() for line in lines],
+    }
+
+
+async def run_ocr_pipeline(image_url, context, auth_headers, image_bytes=None):
+    """`image_bytes` may hold the already downloaded image, as prefetched by chapter jobs."""
+    # A request that finished between our cache check and becoming the leader
+    # has already stored the result.
+    if (cached_entry := await get_cache_entry(image_url)) is not None:
+        return cached_entry
 
-def save_cache():
-    if is_debug_mode:
-        print("[DEBUG] Saving OCR cache...")
-    with open(CACHE_FILE_PATH, "w", encoding="utf-8") as f:
-        json.dump(ocr_cache, f, indent=2, ensure_ascii=False)
-    if is_debug_mode:
-        print("[DEBUG] OCR cache saved successfully.")
+    print(f"[OCR] [{context}] Processing: {image_url}")
+    if image_bytes is None:
+        with timed_stage("fetch"):
+            image_bytes = await fetch_image(image_url, auth_headers)
+
+    # The same page is often served under another host, port or signed query string.
+    # Matching on the image bytes lets those URLs share one OCR result.
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    with timed_stage("hash_lookup"):
+        hash_entry = await asyncio.to_thread(ocr_cache.get_by_hash, content_hash)
+    if hash_entry is not None:
+        cache_entry = {**hash_entry, "context": context}
+        print(f"[OCR] [{context}] Same image already cached, reusing result for: {image_url}")
+    else:
+        recognition = await ocr_flights.run(
+            f"sha256:{content_hash}", lambda: recognize_image(image_bytes, context)
+        )
+        cache_entry = {"context": context, "content_hash": content_hash, **recognition}
+
+    with timed_stage("persist"):
+        await asyncio.to_thread(save_cache_entry, image_url, cache_entry)
+
+    print(f"[OCR] [{context}] Successful for: {image_url}")
+    return cache_entry
+
+
+def merge_config_from_args(args):
+    config = dict(AUTO_MERGE_CONFIG)
+    for arg_name, value in args.items():
+        key = MERGE_QUERY_ALIASES.get(arg_name, arg_name)
+        if key not in config:
+            continue
+        if isinstance(config[key], bool):
+            config[key] = value.strip().lower() in ("1", "true", "yes", "on")
+        else:
+            number = float(value)
+            # NaN compares false with everything, so dist_k=nan would merge every pair.
+            if not math.isfinite(number) or number < 0:
+                raise ValueError(f"{arg_name} must be a finite, non-negative number")
+            config[key] = number
+    return config
+
+
+merged_results_memo = LRUCache(max_entries=MERGE_MEMO_MAX_ENTRIES)
+
+
+def serve_cache_entry(key, entry, config):
+    """Turns a cache entry into the response for `config`. Entries hold the raw engine
+    lines, so auto-merge runs here; its output is memoized per (image, config)."""
+    if "raw" not in entry:
+        # Entries from older versions only have the already merged lines.
+        return entry["data"]
+    if not config["enabled"] or not entry["raw"]:
+        return entry["raw"]
+
+    memo_key = (entry.get("content_hash") or key, tuple(sorted(config.items())))
+    if (merged := merged_results_memo.get(memo_key)) is None:
+        with timed_stage("merge"):
+            merged = merge_raw_lines(entry["raw"], entry["width"], entry["height"], config)
+        merged_results_memo.put(memo_key, merged)
+    return merged
+
+
+def merge_raw_lines(raw, width, height, config):
+    if not config["enabled"] or not raw:
+        return raw
+    return auto_merge_ocr_data([OcrLine.from_bubble(bubble) for bubble in raw], width, height, config)
 
 
 # endregion
@@ -310,205 +903,623 @@ def save_cache():
 # region Background Job
 
 
-def run_chapter_processing_job(base_url, auth_user, auth_pass, context):
-    global active_job_count
-    with active_job_lock:
-        active_job_count += 1
+async def probe_chapter_length(base_url, auth_headers):
+    """Counts the pages of a chapter with HEAD requests, doubling the page index until a
+    page is missing and then bisecting. Returns None if the image server does not
+    answer HEAD for the first page, as its 404s then say nothing about the chapter."""
+    try:
+        if not await page_exists(f"{base_url}0", auth_headers):
+            return None
+        present, missing = 0, 1
+        while await page_exists(f"{base_url}{missing}", auth_headers):
+            present, missing = missing, missing * 2
+            if missing > PREPROCESS_PROBE_MAX_PAGES:
+                return None
+        while missing - present > 1:
+            middle = (present + missing) // 2
+            if await page_exists(f"{base_url}{middle}", auth_headers):
+                present = middle
+            else:
+                missing = middle
+        return missing
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[JobRunner] Could not probe ...{base_url[-40:]}: {e}")
+        return None
 
-    print(f"[JobRunner] [{context}] Started job for ...{base_url[-40:]}. Active jobs: {active_job_count}")
 
-    page_index, consecutive_errors = 0, 0
+async def preprocess_chapter(job: Job):
+    consecutive_errors = 0
     CONSECUTIVE_ERROR_THRESHOLD = 3
-    SERVER_URL_BASE = "http://127.0.0.1:3000"
+    auth_headers = basic_auth_headers(job.user, job.password)
+    context = job.context
+
+    page_count = job.page_count
+    if page_count is None and (page_count := await probe_chapter_length(job.base_url, auth_headers)) is not None:
+        await asyncio.to_thread(job_queue.set_page_count, job, page_count)
+    if page_count is None:
+        print(f"[JobRunner] [{context}] Chapter length unknown, reading pages until one is missing.")
+        page_urls = (f"{job.base_url}{index}" for index in itertools.count())
+    else:
+        print(f"[JobRunner] [{context}] Chapter has {page_count} pages.")
+        page_urls = (f"{job.base_url}{index}" for index in range(page_count))
 
-    while consecutive_errors < CONSECUTIVE_ERROR_THRESHOLD:
-        image_url = f"{base_url}{page_index}"
-        with cache_lock:
-            if image_url in ocr_cache:
-                print(f"[JobRunner] [{context}] Skip (in cache): {image_url}")
-                page_index += 1
-                consecutive_errors = 0
-                continue
+    async def download(image_url):
+        if image_url in ocr_cache:
+            return None
+        with timed_stage("fetch"):
+            return await fetch_image(image_url, auth_headers)
 
-        encoded_url = quote(image_url, safe="")
-        encoded_context = quote(context, safe="")
-        target_url = (f"{SERVER_URL_BASE}/ocr?url={encoded_url}&context={encoded_context}")
-        if auth_user:
-            target_url += f"&user={auth_user}&pass={auth_pass}"
+    # The next pages download while the engine works on the current one.
+    downloads = deque()
 
-        try:
-            print(f"[JobRunner] [{context}] Requesting: {image_url}")
-            response = requests.get(target_url, timeout=45)
-            if response.status_code == 200:
+    def prefetch():
+        while len(downloads) < PREPROCESS_PREFETCH_PAGES and (image_url := next(page_urls, None)) is not None:
+            downloads.append((image_url, asyncio.create_task(download(image_url))))
+
+    try:
+        prefetch()
+        while downloads and consecutive_errors < CONSECUTIVE_ERROR_THRESHOLD:
+            image_url, download_task = downloads.popleft()
+            prefetch()
+            try:
+                image_bytes = await download_task
+                if image_bytes is None:
+                    print(f"[JobRunner] [{context}] Skip (in cache): {image_url}")
+                    preprocess_pages.inc(result="cached")
+                    job.pages_cached += 1
+                    consecutive_errors = 0
+                    continue
+                # Coalesced with any reader asking for the same page. It runs on the
+                # shared loop and is shielded, so cancelling the job lets it finish in
+                # the background instead of failing the readers waiting on it.
+                page = asyncio.run_coroutine_threadsafe(
+                    ocr_flights.run(image_url, lambda: run_ocr_pipeline(image_url, context, auth_headers, image_bytes)),
+                    io_loop.start(),
+                )
+                await asyncio.shield(asyncio.wrap_future(page))
                 consecutive_errors = 0
-            else:
+                preprocess_pages.inc(result="processed")
+                job.pages_done += 1
+            except aiohttp.ClientResponseError as e:
+                if e.status == 404 and page_count is None:
+                    print(f"[JobRunner] [{context}] Page not found, end of chapter: {image_url}")
+                    break
                 consecutive_errors += 1
-                print(f"[JobRunner] [{context}] Got non-200 status ({response.status_code}) for {image_url}. Errors: {consecutive_errors}")
-                if response.status_code == 404:
-                    print("[JobRunner] (Page not found, likely end of chapter)")
-        except requests.exceptions.RequestException as e:
-            consecutive_errors += 1
-            print(f"[JobRunner] [{context}] Request failed for {image_url}. Errors: {consecutive_errors}. Details: {e}")
+                preprocess_pages.inc(result="error")
+                job.errors += 1
+                print(f"[JobRunner] [{context}] Got status {e.status} for {image_url}. Errors: {consecutive_errors}")
+            except Exception as e:
+                consecutive_errors += 1
+                preprocess_pages.inc(result="error")
+                job.errors += 1
+                print(f"[JobRunner] [{context}] Failed on {image_url}. Errors: {consecutive_errors}. Details: {e}")
+    finally:
+        for _, download_task in downloads:
+            download_task.cancel()
 
-        page_index += 1
-        time.sleep(0.1)
+    print(f"[JobRunner] [{context}] Finished job for ...{job.base_url[-40:]}.")
 
-    print(f"[JobRunner] [{context}] Finished job for ...{base_url[-40:]}. Reached {consecutive_errors} errors.")
-    with active_job_lock:
-        active_job_count -= 1
+
+async def run_cancellable(job: Job):
+    loop, task = asyncio.get_running_loop(), asyncio.current_task()
+    job.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        await preprocess_chapter(job)
+    except asyncio.CancelledError:
+        print(f"[JobRunner] [{job.context}] Cancelled job {job.id} for ...{job.base_url[-40:]}")
+    finally:
+        job.on_cancel(None)
+
+
+def run_chapter_job(job: Job):
+    """Runs on a job queue worker thread, which gets its own event loop like a
+    waitress request thread does."""
+    print(f"[JobRunner] [{job.context}] Started job {job.id} for ...{job.base_url[-40:]}")
+    asyncio.run(run_cancellable(job))
 
 
 # endregion
 
 # region Endpoints
+# Each route is implemented once as a framework-neutral handler returning
+# (payload, status), with thin adapters for Flask below and for aiohttp in the
+# "Async Server" region.
 
 
-@app.route("/")
-def status_endpoint():
+def get_status():
     with cache_lock:
-        num_requests, num_cache_items = ocr_requests_processed, len(ocr_cache)
-    with active_job_lock:
-        active_jobs = active_job_count
-    return jsonify({
+        num_requests = ocr_requests_processed
+    # None in lazy mode, where counting would scan the whole cache database.
+    num_cache_items = ocr_cache.indexed_count()
+    job_counts = job_queue.counts()
+    return {
         "status": "running",
         "message": "Python OCR server is active.",
         "requests_processed": num_requests,
         "items_in_cache": num_cache_items,
-        "active_preprocess_jobs": active_jobs,
-    })
+        "active_preprocess_jobs": job_counts["running"],
+        "queued_preprocess_jobs": job_counts["queued"],
+        "in_flight_ocr_requests": ocr_flights.in_flight(),
+        "coalesced_ocr_requests": ocr_flights.coalesced_requests,
+        "cache": ocr_cache.stats(),
+    }
 
 
-@app.route("/ocr")
-async def ocr_endpoint():
-    global ocr_requests_processed
-    image_url = request.args.get("url")
-    context = request.args.get("context", "No Context")
+async def _handle_ocr(args):
+    """Returns (payload, status, result), where result labels the request duration."""
+    image_url = args.get("url")
+    context = args.get("context", "No Context")
 
     if not image_url:
-        return jsonify({"error": "Image URL is required"}), 400
+        return {"error": "Image URL is required"}, 400, "invalid"
 
-    with cache_lock:
-        if image_url in ocr_cache:
-            cached_entry = ocr_cache[image_url]
-            return jsonify(cached_entry.get("data", cached_entry))
-
-    print(f"[OCR] [{context}] Processing: {image_url}")
     try:
-        auth_headers = {}
-        if auth_user := request.args.get("user"):
-            auth_pass = request.args.get("pass", "")
-            auth_base64 = base64.b64encode(f"{auth_user}:{auth_pass}".encode("utf-8")).decode("utf-8")
-            auth_headers["Authorization"] = f"Basic {auth_base64}"
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url, headers=auth_headers) as response:
-                response.raise_for_status()
-                image_bytes = await response.read()
-
-        pil_image = Image.open(io.BytesIO(image_bytes))
-        rgb_image = pil_image.convert("RGB")
-        
-        full_width, full_height = rgb_image.size
-        all_final_results = []
-        MAX_CHUNK_HEIGHT = 3000
-
-        if full_height > MAX_CHUNK_HEIGHT:
-            print(f"[OCR] [{context}] Image is tall ({full_height}px). Processing in chunks.")
-            y_offset = 0
-            while y_offset < full_height:
-                box = (0, y_offset, full_width, min(y_offset + MAX_CHUNK_HEIGHT, full_height))
-                chunk_image = rgb_image.crop(box)
-                chunk_width, chunk_height = chunk_image.size
-                print(f"[OCR] [{context}] Processing chunk at y={y_offset} (size: {chunk_width}x{chunk_height})")
-
-                raw_chunk_results = await ocr_engine.ocr(chunk_image)
-                
-                merged_chunk_results = raw_chunk_results
-                if AUTO_MERGE_CONFIG["enabled"] and raw_chunk_results:
-                    merged_chunk_results = auto_merge_ocr_data(raw_chunk_results, chunk_width, chunk_height, AUTO_MERGE_CONFIG)
-
-                for result in merged_chunk_results:
-                    bbox = result['tightBoundingBox']
-                    x_local_px = bbox['x'] * chunk_width
-                    y_local_px = bbox['y'] * chunk_height
-                    width_px = bbox['width'] * chunk_width
-                    height_px = bbox['height'] * chunk_height
-
-                    y_global_px = y_local_px + y_offset
-                    result['tightBoundingBox'] = {
-                        'x': x_local_px / full_width,
-                        'y': y_global_px / full_height,
-                        'width': width_px / full_width,
-                        'height': height_px / full_height
-                    }
-                    all_final_results.append(result)
-                
-                y_offset += MAX_CHUNK_HEIGHT
-        else:
-            raw_results = await ocr_engine.ocr(rgb_image)
-            all_final_results = raw_results
-            if AUTO_MERGE_CONFIG["enabled"] and raw_results:
-                all_final_results = auto_merge_ocr_data(raw_results, full_width, full_height, AUTO_MERGE_CONFIG)
-        
-        with cache_lock:
-            ocr_cache[image_url] = {"context": context, "data": all_final_results}
-            ocr_requests_processed += 1
-            save_cache()
+        merge_config = merge_config_from_args(args)
+    except ValueError as e:
+        return {"error": f"Invalid auto-merge parameter: {e}"}, 400, "invalid"
+
+    auth_headers = basic_auth_headers(args.get("user"), args.get("pass"))
+    return await ocr_image_url(image_url, context, auth_headers, merge_config)
 
-        print(f"[OCR] [{context}] Successful for: {image_url}")
-        return jsonify(all_final_results)
 
+async def ocr_image_url(image_url, context, auth_headers, merge_config):
+    """Returns (payload, status, result) for one image, from the cache or the pipeline."""
+    with timed_stage("cache_lookup"):
+        cached_entry = await get_cache_entry(image_url)
+    if cached_entry is not None:
+        return await asyncio.to_thread(serve_cache_entry, image_url, cached_entry, merge_config), 200, "hit"
+
+    try:
+        cache_entry = await ocr_flights.run(image_url, lambda: run_ocr_pipeline(image_url, context, auth_headers))
+        return await asyncio.to_thread(serve_cache_entry, image_url, cache_entry, merge_config), 200, "miss"
     except aiohttp.ClientResponseError as e:
         print(f"[OCR] [{context}] ERROR fetching {image_url}: Status {e.status}")
-        return jsonify({"error": f"Failed to fetch image from URL, status: {e.status}"}), e.status
+        return {"error": f"Failed to fetch image from URL, status: {e.status}"}, e.status, "error"
+    except ImageTooLargeError as e:
+        print(f"[OCR] [{context}] Image too large: {image_url}")
+        return {"error": str(e)}, 413, "invalid"
     except Exception as e:
         print(f"[OCR] [{context}] ERROR on {image_url}: {e}")
         if is_debug_mode:
             traceback.print_exc()
-        return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
+        return {"error": f"An unexpected error occurred: {e}"}, 500, "error"
 
 
-@app.route("/preprocess-chapter", methods=["POST"])
-def preprocess_chapter_endpoint():
-    data = request.json
-    if data is None:
-        return jsonify({"error": "Invalid JSON payload"}), 400
+async def handle_ocr(args):
+    """Returns (payload, status, Server-Timing header value)."""
+    timings = []
+    request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        payload, status, result = await _handle_ocr(args)
+    finally:
+        request_profiler.request_finished()
+    elapsed = time.perf_counter() - start
+    ocr_request_seconds.observe(elapsed, result=result)
+    timings.append(("total", elapsed, None))
+    return payload, status, format_server_timing(timings)
+
+
+def parse_ocr_batch(data, args):
+    """Returns (urls, context, auth headers, merge config) of an /ocr/batch request, or
+    raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Invalid JSON payload")
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        raise ValueError("urls must be a non-empty list of image URLs")
+    if len(urls) > OCR_BATCH_MAX_URLS:
+        raise ValueError(f"At most {OCR_BATCH_MAX_URLS} urls per batch")
+    try:
+        merge_config = merge_config_from_args(args)
+    except ValueError as e:
+        raise ValueError(f"Invalid auto-merge parameter: {e}") from None
+    auth_headers = basic_auth_headers(data.get("user"), data.get("pass"))
+    return urls, data.get("context", "No Context"), auth_headers, merge_config
+
+
+async def ocr_batch_results(urls, context, auth_headers, merge_config, disconnected=None):
+    """Yields one result per URL in the order they are ready: cache hits right away,
+    then misses as they finish, at most OCR_BATCH_CONCURRENCY at a time.
+
+    Misses that have not started are dropped once the results stop being read,
+    either because the iterator is closed or because `disconnected()`, polled while
+    misses run, says the client has gone."""
+    entries = [ocr_cache.get_from_memory(image_url) for image_url in urls]
+    if unknown := [index for index, entry in enumerate(entries) if entry is None]:
+        # Everything not in memory is read from the store in one trip to a thread.
+        stored = await asyncio.to_thread(lambda: [ocr_cache.get(urls[index]) for index in unknown])
+        for index, entry in zip(unknown, stored):
+            entries[index] = entry
+
+    misses = []
+    for index, (image_url, cached_entry) in enumerate(zip(urls, entries)):
+        start = time.perf_counter()
+        if cached_entry is not None:
+            payload = await asyncio.to_thread(serve_cache_entry, image_url, cached_entry, merge_config)
+            ocr_request_seconds.observe(time.perf_counter() - start, result="hit")
+            yield batch_result(index, image_url, payload, 200)
+        else:
+            misses.append((index, image_url))
+    if not misses:
+        return
+
+    semaphore = asyncio.Semaphore(OCR_BATCH_CONCURRENCY)
+    # Misses waiting for the semaphore. Only touched on the shared loop, so none can
+    # start between `abandon` checking the flag and cancelling it.
+    waiting = set()
+    abandoned = False
+
+    async def recognize(index, image_url):
+        waiting.add(task := asyncio.current_task())
+        try:
+            await semaphore.acquire()
+        finally:
+            waiting.discard(task)
+        try:
+            if abandoned:
+                raise asyncio.CancelledError
+            start = time.perf_counter()
+            payload, status, result = await ocr_image_url(image_url, context, auth_headers, merge_config)
+            ocr_request_seconds.observe(time.perf_counter() - start, result=result)
+        finally:
+            semaphore.release()
+        return batch_result(index, image_url, payload, status)
+
+    def abandon():
+        nonlocal abandoned
+        abandoned = True
+        for task in waiting:
+            task.cancel()
+
+    # Misses run on the shared loop, so images already being recognized finish and
+    # are cached if the client goes away, while the ones still waiting are dropped.
+    loop = io_loop.start()
+    pending = {
+        asyncio.wrap_future(asyncio.run_coroutine_threadsafe(recognize(index, image_url), loop))
+        for index, image_url in misses
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=BATCH_DISCONNECT_POLL_SECONDS if disconnected else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected is not None and disconnected():
+                print(f"[OCR] [{context}] Batch client disconnected, dropping {len(pending)} images.")
+                return
+            for future in done:
+                yield future.result()
+    finally:
+        if pending:
+            if asyncio.get_running_loop() is loop:
+                abandon()
+            else:
+                loop.call_soon_threadsafe(abandon)
+
+
+def batch_result(index, image_url, payload, status):
+    result = {"index": index, "url": image_url, "status": status}
+    if status == 200:
+        result["data"] = payload
+    else:
+        result["error"] = payload["error"]
+    return result
+
+
+def ndjson_line(result):
+    return json.dumps(result, ensure_ascii=False) + "\n"
+
+
+def iterate_in_new_loop(async_iterator):
+    """Drives an async iterator from a plain generator, as a streamed Flask response
+    is consumed after the view, and its event loop, have returned."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(async_iterator))
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+        loop.close()
+
+
+def stream_format(args, accept):
+    """The streaming format an /ocr request opted into with ?stream= or its Accept
+    header: "ndjson", "sse" or None for a plain JSON response. Requests without an
+    image URL get the plain error response."""
+    if not args.get("url"):
+        return None
+    requested = args.get("stream", "").strip().lower()
+    if requested in ("sse", "ndjson"):
+        return requested
+    if requested in ("1", "true", "yes", "on"):
+        return "sse" if "text/event-stream" in accept else "ndjson"
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return None
+
+
+async def ocr_stream_events(args):
+    """Yields the events of a streamed /ocr request: a "chunk" event with the merged
+    lines of each chunk of a tall image as soon as it is recognized, then a "result"
+    event with the same payload and status a plain request would get. Chunks are
+    merged on their own, so lines crossing a cut are only joined, and lines seen by
+    two overlapping chunks only deduplicated, in the result.
+    Cache hits, short images and requests joining one in flight only get the result."""
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def on_chunk(*chunk):
+        # A Flask stream's loop is closed once its client goes away, the chunks
+        # recognized after that have nowhere to go.
+        if loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        except RuntimeError:
+            pass  # Closed in the meantime.
+
+    try:
+        merge_config = merge_config_from_args(args)
+    except ValueError:
+        merge_config = None  # handle_ocr reports it.
+
+    # Runs on the shared loop, so the image is still recognized and cached if the
+    # client goes away. The task takes the listener along in its context.
+    token = chunk_listener.set(on_chunk if merge_config else None)
+    try:
+        response = asyncio.wrap_future(asyncio.run_coroutine_threadsafe(handle_ocr(args), io_loop.start()))
+    finally:
+        chunk_listener.reset(token)
+
+    async def chunk_event(chunk):
+        index, count, raw, width, height = chunk
+        merged = await asyncio.to_thread(merge_raw_lines, raw, width, height, merge_config)
+        return "chunk", {"chunk": index, "chunks": count, "data": merged}
+
+    while not response.done():
+        next_chunk = asyncio.ensure_future(chunks.get())
+        await asyncio.wait((response, next_chunk), return_when=asyncio.FIRST_COMPLETED)
+        if not next_chunk.done():
+            next_chunk.cancel()
+            break
+        yield await chunk_event(next_chunk.result())
+    # Chunks are handed over before the response completes, so the ones recognized
+    # last are queued by now.
+    while not chunks.empty():
+        yield await chunk_event(chunks.get_nowait())
+
+    payload, status, server_timing = await response
+    result = {"status": status, "data": payload} if status == 200 else {"status": status, **payload}
+    yield "result", {**result, "server_timing": server_timing}
+
+
+def stream_event(event, data, output_format):
+    if output_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return ndjson_line({"event": event, **data})
+
+
+def handle_preprocess_chapter(data):
+    if not isinstance(data, dict):
+        return {"error": "Invalid JSON payload"}, 400
 
     base_url = data.get("baseUrl")
     context = data.get("context", "No Context")
 
     if not base_url:
-        return jsonify({"error": "baseUrl is required"}), 400
+        return {"error": "baseUrl is required"}, 400
 
-    job_thread = threading.Thread(
-        target=run_chapter_processing_job,
-        args=(base_url, data.get("user"), data.get("pass"), context),
-        daemon=True,
-    )
-    job_thread.start()
+    page_count = data.get("pageCount")
+    if page_count is not None and (type(page_count) is not int or page_count < 0):
+        return {"error": "pageCount must be a non-negative integer"}, 400
 
-    print(f"[Queue] [{context}] Job started in new thread for ...{base_url[-40:]}")
-    return jsonify({
+    try:
+        job, created = job_queue.submit(base_url, context, data.get("user"), data.get("pass"), page_count)
+    except JobQueueFull as e:
+        return {"error": f"Too many chapters queued: {e}"}, 503
+
+    if not created:
+        print(f"[Queue] [{context}] Job {job.id} for ...{base_url[-40:]} is already {job.state}")
+        return {
+            "status": "accepted",
+            "message": f"Chapter pre-processing job is already {job.state}.",
+            "job_id": job.id,
+        }, 202
+
+    print(f"[Queue] [{context}] Queued job {job.id} for ...{base_url[-40:]}")
+    return {
         "status": "accepted",
-        "message": "Chapter pre-processing job has been started.",
-    }), 202
+        "message": "Chapter pre-processing job has been queued.",
+        "job_id": job.id,
+    }, 202
 
 
-@app.route("/purge-cache", methods=["POST"])
-def purge_cache_endpoint():
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in job_queue.jobs()]}
+
+
+def cancel_job(job_id):
+    if (job := job_queue.cancel(job_id)) is None:
+        return {"error": f"No job with id {job_id}."}, 404
+    print(f"[Queue] [{job.context}] Cancel requested for job {job.id} ({job.state})")
+    return job.to_dict(), 200
+
+
+def purge_cache():
     with cache_lock:
-        count = len(ocr_cache)
-        ocr_cache.clear()
-        save_cache()
+        count = ocr_cache.clear()
+        merged_results_memo.clear()
         print(f"[Cache] Purged. Removed {count} items.")
-    return jsonify({"status": "success", "message": f"Cache purged. Removed {count} items."})
+    return {"status": "success", "message": f"Cache purged. Removed {count} items."}
+
+
+def export_cache_batch(after_key=None, batch_size=EXPORT_BATCH_SIZE):
+    """Returns the next `batch_size` cache entries after `after_key` as part of one JSON
+    object in the format of the old ocr-cache.json, and the key to continue after, or
+    None once the object is closed. Every batch is a single read of the store, so the
+    batches of one export may be fetched on different threads."""
+    rows = ocr_cache.items_after(after_key, batch_size)
+    parts = ["{"] if after_key is None else []
+    for index, (key, entry) in enumerate(rows):
+        separator = "," if index or after_key is not None else ""
+        parts.append(f"{separator}\n  {json.dumps(key, ensure_ascii=False)}: {json.dumps(entry, ensure_ascii=False)}")
+    if len(rows) < batch_size:
+        parts.append("\n}\n")
+        return "".join(parts), None
+    return "".join(parts), rows[-1][0]
+
+
+def export_cache_chunks():
+    """Yields the whole cache as one JSON object, a batch of entries at a time."""
+    chunk, after_key = export_cache_batch()
+    yield chunk
+    while after_key is not None:
+        chunk, after_key = export_cache_batch(after_key)
+        yield chunk
+
+
+def handle_import_cache(filename, file_bytes):
+    if not (filename and filename.endswith(".json")):
+        return {"error": "Invalid file."}, 400
+    try:
+        imported_data = json.loads(file_bytes.decode("utf-8"))
+        if not isinstance(imported_data, dict):
+            return {"error": "Invalid cache format."}, 400
+        new_entries = {}
+        for key, value in imported_data.items():
+            if (entry := normalize_cache_entry(value)) is not None:
+                new_entries[key] = entry
+        with cache_lock:
+            new_items = ocr_cache.put_many(new_entries)
+            total_items = len(ocr_cache)
+        return {
+            "message": f"Import successful. Added {new_items} new items.",
+            "total_items_in_cache": total_items,
+        }, 200
+    except Exception as e:
+        return {"error": f"Import failed: {e}"}, 500
+
+
+def handle_start_profile(args):
+    try:
+        requests_to_capture = int(args.get("requests", 10))
+        request_profiler.start(requests_to_capture)
+    except ValueError as e:
+        return {"error": f"Invalid request count: {e}"}, 400
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+    print(f"[Profile] Capturing the next {requests_to_capture} /ocr requests.")
+    return request_profiler.status(), 202
+
+
+def profile_download(output_format):
+    """Returns (body, content type, file name) of the last profile, or None."""
+    if output_format == "text":
+        summary = request_profiler.summary()
+        return (summary.encode("utf-8"), "text/plain; charset=utf-8", "ocr-profile.txt") if summary else None
+    data = request_profiler.dump()
+    return (data, "application/octet-stream", "ocr-profile.prof") if data else None
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+STREAM_CONTENT_TYPES = {"ndjson": NDJSON_CONTENT_TYPE, "sse": "text/event-stream"}
+PROFILE_DISABLED = {"error": "Profiling is only available in debug mode (-d)."}
+
+
+@app.route("/")
+def status_endpoint():
+    return jsonify(get_status())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(render_metrics(all_metrics), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/ocr")
+async def ocr_endpoint():
+    if (output_format := stream_format(request.args, request.headers.get("Accept", ""))) is not None:
+        events = iterate_in_new_loop(ocr_stream_events(request.args))
+        return Response(
+            (stream_event(event, data, output_format) for event, data in events),
+            content_type=STREAM_CONTENT_TYPES[output_format],
+            headers={"Cache-Control": "no-cache"},
+        )
+    payload, status, server_timing = await handle_ocr(request.args)
+    return jsonify(payload), status, {"Server-Timing": server_timing}
+
+
+@app.route("/ocr/batch", methods=["POST"])
+def ocr_batch_endpoint():
+    try:
+        urls, context, auth_headers, merge_config = parse_ocr_batch(request.get_json(silent=True), request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    print(f"[OCR] [{context}] Batch of {len(urls)} images.")
+    # Set by waitress; it only notices a disconnect while reading ahead, see main().
+    disconnected = request.environ.get("waitress.client_disconnected")
+    results = iterate_in_new_loop(ocr_batch_results(urls, context, auth_headers, merge_config, disconnected))
+    return Response((ndjson_line(result) for result in results), mimetype=NDJSON_CONTENT_TYPE)
+
+
+@app.route("/profile", methods=["GET", "POST"])
+def profile_endpoint():
+    if not is_debug_mode:
+        return jsonify(PROFILE_DISABLED), 403
+    if request.method == "POST":
+        payload, status = handle_start_profile(request.args)
+        return jsonify(payload), status
+    return jsonify(request_profiler.status())
+
+
+@app.route("/profile/download")
+def profile_download_endpoint():
+    if not is_debug_mode:
+        return jsonify(PROFILE_DISABLED), 403
+    if (download := profile_download(request.args.get("format", "pstats"))) is None:
+        return jsonify({"error": "No profile has been captured yet."}), 404
+    body, content_type, filename = download
+    return Response(body, content_type=content_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.route("/preprocess-chapter", methods=["POST"])
+def preprocess_chapter_endpoint():
+    payload, status = handle_preprocess_chapter(request.get_json(silent=True))
+    return jsonify(payload), status
+
+
+@app.route("/jobs")
+def jobs_endpoint():
+    return jsonify(list_jobs())
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job_endpoint(job_id):
+    payload, status = cancel_job(job_id)
+    return jsonify(payload), status
+
+
+@app.route("/purge-cache", methods=["POST"])
+def purge_cache_endpoint():
+    return jsonify(purge_cache())
 
 
 @app.route("/export-cache")
 def export_cache_endpoint():
-    if not os.path.exists(CACHE_FILE_PATH):
+    if ocr_cache.is_empty():
         return jsonify({"error": "No cache file to export."}), 404
-    return send_file(CACHE_FILE_PATH, as_attachment=True, download_name="ocr-cache.json")
+    return Response(
+        export_cache_chunks(),
+        mimetype="application/json",
+        headers={"Content-Disposition": "attachment; filename=ocr-cache.json"},
+    )
 
 
 @app.route("/import-cache", methods=["POST"])
@@ -516,32 +1527,173 @@ def import_cache_endpoint():
     if "cacheFile" not in request.files:
         return jsonify({"error": "No file part."}), 400
     file = request.files["cacheFile"]
-    if not (file.filename and file.filename.endswith(".json")):
-        return jsonify({"error": "Invalid file."}), 400
+    payload, status = handle_import_cache(file.filename, file.read())
+    return jsonify(payload), status
+
+
+# endregion
+
+# region Async Server
+# Serves the same routes from a single event loop with aiohttp.web. Downloads, engine
+# calls and cache lookups of all requests then share one loop instead of one
+# throwaway loop per waitress worker thread.
+
+
+async def aio_status_endpoint(request):
+    return web.json_response(await asyncio.to_thread(get_status))
+
+
+async def aio_metrics_endpoint(request):
+    text = await asyncio.to_thread(render_metrics, all_metrics)
+    return web.Response(body=text.encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+async def aio_ocr_endpoint(request):
+    if (output_format := stream_format(request.query, request.headers.get("Accept", ""))) is not None:
+        return await aio_ocr_stream(request, output_format)
+    payload, status, server_timing = await handle_ocr(request.query)
+    return web.json_response(payload, status=status, headers={"Server-Timing": server_timing})
+
+
+async def aio_ocr_stream(request, output_format):
+    response = web.StreamResponse(headers={
+        "Content-Type": STREAM_CONTENT_TYPES[output_format],
+        "Cache-Control": "no-cache",
+    })
+    await response.prepare(request)
+    async with aclosing(ocr_stream_events(request.query)) as events:
+        try:
+            async for event, data in events:
+                await response.write(stream_event(event, data, output_format).encode("utf-8"))
+        except ConnectionResetError:
+            return response
+    await response.write_eof()
+    return response
+
+
+async def aio_ocr_batch_endpoint(request):
     try:
-        imported_data = json.loads(file.read().decode("utf-8"))
-        if not isinstance(imported_data, dict):
-            return jsonify({"error": "Invalid cache format."}), 400
-        with cache_lock:
-            new_items = 0
-            for key, value in imported_data.items():
-                if key not in ocr_cache:
-                    if isinstance(value, list):
-                        ocr_cache[key] = {"context": "Imported Data", "data": value}
-                    elif isinstance(value, dict) and "data" in value:
-                        ocr_cache[key] = value
-                    else:
-                        continue 
-                    new_items += 1
-            if new_items > 0:
-                save_cache()
-            total_items = len(ocr_cache)
-        return jsonify({
-            "message": f"Import successful. Added {new_items} new items.",
-            "total_items_in_cache": total_items,
-        })
-    except Exception as e:
-        return jsonify({"error": f"Import failed: {e}"}), 500
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = None
+    try:
+        urls, context, auth_headers, merge_config = parse_ocr_batch(data, request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    print(f"[OCR] [{context}] Batch of {len(urls)} images.")
+    response = web.StreamResponse(headers={"Content-Type": NDJSON_CONTENT_TYPE})
+    await response.prepare(request)
+    def disconnected():
+        return request.transport is None or request.transport.is_closing()
+
+    async with aclosing(ocr_batch_results(urls, context, auth_headers, merge_config, disconnected)) as results:
+        try:
+            async for result in results:
+                await response.write(ndjson_line(result).encode("utf-8"))
+        except ConnectionResetError:
+            print(f"[OCR] [{context}] Batch client disconnected.")
+            return response
+    await response.write_eof()
+    return response
+
+
+async def aio_profile_endpoint(request):
+    if not is_debug_mode:
+        return web.json_response(PROFILE_DISABLED, status=403)
+    if request.method == "POST":
+        payload, status = handle_start_profile(request.query)
+        return web.json_response(payload, status=status)
+    return web.json_response(request_profiler.status())
+
+
+async def aio_profile_download_endpoint(request):
+    if not is_debug_mode:
+        return web.json_response(PROFILE_DISABLED, status=403)
+    download = await asyncio.to_thread(profile_download, request.query.get("format", "pstats"))
+    if download is None:
+        return web.json_response({"error": "No profile has been captured yet."}, status=404)
+    body, content_type, filename = download
+    return web.Response(body=body, headers={
+        "Content-Type": content_type,
+        "Content-Disposition": f"attachment; filename={filename}",
+    })
+
+
+async def aio_preprocess_chapter_endpoint(request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = None
+    # Queuing a job writes it to the jobs database.
+    payload, status = await asyncio.to_thread(handle_preprocess_chapter, data)
+    return web.json_response(payload, status=status)
+
+
+async def aio_jobs_endpoint(request):
+    return web.json_response(list_jobs())
+
+
+async def aio_cancel_job_endpoint(request):
+    payload, status = await asyncio.to_thread(cancel_job, request.match_info["job_id"])
+    return web.json_response(payload, status=status)
+
+
+async def aio_purge_cache_endpoint(request):
+    return web.json_response(await asyncio.to_thread(purge_cache))
+
+
+async def aio_export_cache_endpoint(request):
+    if await asyncio.to_thread(ocr_cache.is_empty):
+        return web.json_response({"error": "No cache file to export."}, status=404)
+    response = web.StreamResponse(headers={
+        "Content-Type": "application/json",
+        "Content-Disposition": "attachment; filename=ocr-cache.json",
+    })
+    await response.prepare(request)
+    chunk, after_key = await asyncio.to_thread(export_cache_batch)
+    await response.write(chunk.encode("utf-8"))
+    while after_key is not None:
+        chunk, after_key = await asyncio.to_thread(export_cache_batch, after_key)
+        await response.write(chunk.encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def aio_import_cache_endpoint(request):
+    form = await request.post()
+    file = form.get("cacheFile")
+    if not isinstance(file, web.FileField):
+        return web.json_response({"error": "No file part."}, status=400)
+    payload, status = await asyncio.to_thread(handle_import_cache, file.filename, file.file.read())
+    return web.json_response(payload, status=status)
+
+
+def create_async_app():
+    async def on_startup(aio_app):
+        io_loop.attach(asyncio.get_running_loop())
+        start_job_queue()
+
+    async def on_cleanup(aio_app):
+        await io_loop.close_session()
+
+    # Cache imports can be far larger than aiohttp's 1 MB default body limit.
+    aio_app = web.Application(client_max_size=1024**3)
+    aio_app.on_startup.append(on_startup)
+    aio_app.on_cleanup.append(on_cleanup)
+    aio_app.router.add_get("/", aio_status_endpoint)
+    aio_app.router.add_get("/metrics", aio_metrics_endpoint)
+    aio_app.router.add_get("/ocr", aio_ocr_endpoint)
+    aio_app.router.add_post("/ocr/batch", aio_ocr_batch_endpoint)
+    aio_app.router.add_get("/profile", aio_profile_endpoint)
+    aio_app.router.add_post("/profile", aio_profile_endpoint)
+    aio_app.router.add_get("/profile/download", aio_profile_download_endpoint)
+    aio_app.router.add_post("/preprocess-chapter", aio_preprocess_chapter_endpoint)
+    aio_app.router.add_get("/jobs", aio_jobs_endpoint)
+    aio_app.router.add_post("/jobs/{job_id}/cancel", aio_cancel_job_endpoint)
+    aio_app.router.add_post("/purge-cache", aio_purge_cache_endpoint)
+    aio_app.router.add_get("/export-cache", aio_export_cache_endpoint)
+    aio_app.router.add_post("/import-cache", aio_import_cache_endpoint)
+    return aio_app
 
 
 # endregion
@@ -550,33 +1702,123 @@ def import_cache_endpoint():
 
 
 def main():
-    global ocr_engine, is_debug_mode
+    global ocr_engine, is_debug_mode, PORT, HTTP_POOL_MAX_CONNECTIONS_PER_HOST, HTTP_TOTAL_TIMEOUT, PREPROCESS_PREFETCH_PAGES
     parser = argparse.ArgumentParser(description="Run the Python OCR Server.")
     parser.add_argument("-d", "--debug", action="store_true", help="enable debug mode")
-    parser.add_argument("-e", "--engine", type=str, default="lens", help="OCR engine to use: 'lens', 'oneocr'")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("-e", "--engine", type=str, default="lens", help="OCR engine to use: 'lens', 'oneocr', 'stub', 'record', 'replay'")
+    parser.add_argument(
+        "--engine-option",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help=(
+            "engine-specific option, may be repeated, e.g. latency=0.5 and lines=40 for the 'stub' load-test engine, "
+            "engine=lens and path=DIR for 'record', path=DIR and latency=0.5 for 'replay'"
+        ),
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes for the oneocr engine (default: one per CPU core, 0 to run in-process)",
+    )
+    parser.add_argument(
+        "--engine-concurrency",
+        type=int,
+        default=None,
+        help="maximum OCR engine calls in flight at once, e.g. chunks of a tall image (default depends on the engine)",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=OcrCache.MODES,
+        default="lazy",
+        help="what to load from the cache at startup: the keys plus as many entries as fit in memory ('eager'), only the keys ('keys') or nothing ('lazy')",
+    )
+    parser.add_argument(
+        "--cache-memory-entries",
+        type=int,
+        default=CACHE_MEMORY_MAX_ENTRIES,
+        help="maximum number of OCR results kept in memory, 0 for no limit",
+    )
+    parser.add_argument(
+        "--cache-memory-mb",
+        type=int,
+        default=CACHE_MEMORY_MAX_BYTES // (1024 * 1024),
+        help="approximate memory budget in MB for cached OCR results, 0 for no limit",
+    )
+    parser.add_argument(
+        "--http-connections-per-host",
+        type=int,
+        default=HTTP_POOL_MAX_CONNECTIONS_PER_HOST,
+        help="maximum pooled connections to a single image host",
+    )
+    parser.add_argument(
+        "--http-timeout",
+        type=float,
+        default=HTTP_TOTAL_TIMEOUT,
+        help="timeout in seconds for downloading a single image",
+    )
+    parser.add_argument(
+        "--preprocess-workers",
+        type=int,
+        default=PREPROCESS_WORKERS,
+        help="chapters pre-processed at once, further chapters wait in a queue",
+    )
+    parser.add_argument(
+        "--preprocess-prefetch",
+        type=int,
+        default=PREPROCESS_PREFETCH_PAGES,
+        help="pages a chapter pre-processing job downloads ahead of the one being recognized",
+    )
+    parser.add_argument(
+        "--server",
+        choices=("waitress", "aiohttp"),
+        default="waitress",
+        help="HTTP server: waitress (one thread per request) or aiohttp (one shared event loop)",
+    )
     args = parser.parse_args()
     is_debug_mode = args.debug
+    PORT = args.port
+    HTTP_POOL_MAX_CONNECTIONS_PER_HOST = args.http_connections_per_host
+    HTTP_TOTAL_TIMEOUT = args.http_timeout
+    PREPROCESS_PREFETCH_PAGES = max(args.preprocess_prefetch, 1)
 
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(IMAGE_CACHE_FOLDER, exist_ok=True)
 
     print(f"[Engine] Initializing {args.engine}...")
     try:
-        ocr_engine = initialize_engine(args.engine)
+        engine_options = dict(option.split("=", 1) for option in args.engine_option)
+        ocr_engine = initialize_engine(args.engine, args.workers, engine_options)
+        if args.engine_concurrency:
+            ocr_engine.max_concurrency = args.engine_concurrency
         print(f"[Engine] {args.engine} initialization complete.")
     except Exception as e:
         print(f"[Engine] Failed to initialize {args.engine}: {e}")
         raise SystemExit(1)
 
-    load_cache()
+    load_cache(args.cache_mode, args.cache_memory_entries, args.cache_memory_mb * 1024 * 1024)
+    load_job_queue(args.preprocess_workers)
+
+    if args.server == "aiohttp":
+        print("--- Starting aiohttp Async Server ---")
+        print(f"URL: http://{IP_ADDRESS}:{PORT}")
+        web.run_app(create_async_app(), host=IP_ADDRESS, port=PORT, print=None)
+        return
 
+    io_loop.start()
+    start_job_queue()
     if is_debug_mode:
         print("--- Starting Flask Development Server in DEBUG MODE ---")
         app.run(host=IP_ADDRESS, port=PORT, debug=True, use_reloader=False)
     else:
         print("--- Starting Waitress Production Server ---")
         print(f"URL: http://{IP_ADDRESS}:{PORT}")
-        serve(app, host=IP_ADDRESS, port=PORT)
+        # Reading ahead on each connection lets long streamed responses, like
+        # /ocr/batch, notice when their client has gone.
+        serve(app, host=IP_ADDRESS, port=PORT, channel_request_lookahead=1)
 
 
 if __name__ == "__main__":
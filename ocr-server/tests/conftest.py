@@ -0,0 +1,117 @@
+import asyncio
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+import server
+from engines import StubEngine
+
+
+def png_bytes(width=400, height=600, color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def ocr_server(tmp_path, monkeypatch):
+    """The server module with its cache and job database in `tmp_path`, a stub engine
+    and a shared I/O loop of its own."""
+    monkeypatch.setattr(server, "CACHE_FILE_PATH", str(tmp_path / "ocr-cache.db"))
+    monkeypatch.setattr(server, "LEGACY_CACHE_FILE_PATH", str(tmp_path / "ocr-cache.json"))
+    monkeypatch.setattr(server, "JOBS_FILE_PATH", str(tmp_path / "ocr-jobs.db"))
+    monkeypatch.setattr(server, "io_loop", server.SharedIoLoop())
+    monkeypatch.setattr(server, "ocr_engine", StubEngine(lines=4), raising=False)
+    server.merged_results_memo.clear()
+    server.load_cache("lazy")
+    server.load_job_queue(1)
+    yield server
+    loop = server.io_loop.loop
+    # In aiohttp mode the loop was the test's own and is closed by now.
+    if loop is not None and not loop.is_closed():
+        server.io_loop.stop()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+@pytest.fixture
+def flask_client(ocr_server):
+    return ocr_server.app.test_client()
+
+
+@pytest.fixture
+def run_aiohttp(ocr_server):
+    """Runs `test(client)` against the aiohttp app in a new event loop and returns its
+    result."""
+
+    def run(test):
+        async def main():
+            async with TestClient(TestServer(ocr_server.create_async_app())) as client:
+                return await test(client)
+
+        return asyncio.run(main())
+
+    return run
+
+
+class ImageHost:
+    """Local HTTP server for page images. `pages` maps paths to image bytes; GET and
+    HEAD of any other path are 404. Every request is counted in `requests`."""
+
+    def __init__(self):
+        self.pages: dict[str, bytes] = {}
+        self.requests: list[tuple[str, str]] = []
+        self.delay = 0.0
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, send_body):
+                host.requests.append((self.command, self.path))
+                if host.delay:
+                    threading.Event().wait(host.delay)
+                body = host.pages.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def downloads(self, prefix=""):
+        return [path for method, path in self.requests if method == "GET" and path.startswith(prefix)]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def image_host():
+    host = ImageHost()
+    yield host
+    host.close()
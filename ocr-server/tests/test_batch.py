@@ -0,0 +1,104 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+from waitress import create_server
+
+from conftest import png_bytes
+
+
+def host_pages(image_host, count):
+    for index in range(count):
+        image_host.pages[f"/page/{index}"] = png_bytes(200, 300, (index, index, index))
+    return [image_host.url(f"/page/{index}") for index in range(count)]
+
+
+def check_results(lines, urls, hits):
+    results = [json.loads(line) for line in lines]
+    assert sorted(result["index"] for result in results) == list(range(len(urls)))
+    # Cache hits are answered before any miss.
+    assert {result["index"] for result in results[: len(hits)]} == set(hits)
+    for result in results:
+        assert result["url"] == urls[result["index"]]
+    return {result["index"]: result for result in results}
+
+
+def test_batch_flask(flask_client, ocr_server, image_host):
+    urls = host_pages(image_host, 5) + [image_host.url("/missing")]
+    ocr_server.ocr_cache.put(urls[3], {"context": "ctx", "raw": [], "width": 200, "height": 300})
+
+    response = flask_client.post("/ocr/batch", json={"urls": urls, "context": "ctx"})
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    results = check_results(response.get_data(as_text=True).splitlines(), urls, hits=[3])
+    assert results[5]["status"] == 404 and "error" in results[5]
+    assert all(results[index]["status"] == 200 and len(results[index]["data"]) for index in (0, 1, 2, 4))
+    assert all(ocr_server.ocr_cache.get(url) for url in urls[:5])
+
+
+def test_batch_aiohttp(run_aiohttp, ocr_server, image_host):
+    urls = host_pages(image_host, 4)
+    ocr_server.ocr_cache.put(urls[1], {"context": "ctx", "raw": [], "width": 200, "height": 300})
+
+    async def post(client):
+        response = await client.post("/ocr/batch", json={"urls": urls})
+        return response.status, (await response.text()).splitlines()
+
+    status, lines = run_aiohttp(post)
+    assert status == 200
+    results = check_results(lines, urls, hits=[1])
+    assert all(result["status"] == 200 for result in results.values())
+
+
+@pytest.mark.parametrize("payload", [None, {}, {"urls": []}, {"urls": [1]}, {"urls": "http://x"}])
+def test_batch_rejects_invalid_payloads(flask_client, payload):
+    assert flask_client.post("/ocr/batch", json=payload).status_code == 400
+
+
+def test_batch_rejects_too_many_urls(flask_client, ocr_server, monkeypatch):
+    monkeypatch.setattr(ocr_server, "OCR_BATCH_MAX_URLS", 2)
+    urls = ["http://images.test/1", "http://images.test/2", "http://images.test/3"]
+    assert flask_client.post("/ocr/batch", json={"urls": urls}).status_code == 400
+
+
+def slow_batch(ocr_server, image_host, monkeypatch):
+    monkeypatch.setattr(ocr_server, "OCR_BATCH_CONCURRENCY", 2)
+    monkeypatch.setattr(ocr_server, "BATCH_DISCONNECT_POLL_SECONDS", 0.05)
+    image_host.delay = 0.3
+    return host_pages(image_host, 8)
+
+
+def test_aiohttp_batch_stops_when_the_client_leaves(run_aiohttp, ocr_server, image_host, monkeypatch):
+    urls = slow_batch(ocr_server, image_host, monkeypatch)
+
+    async def read_one_and_leave(client):
+        response = await client.post("/ocr/batch", json={"urls": urls})
+        first = await response.content.readline()
+        response.close()
+        return json.loads(first)
+
+    assert run_aiohttp(read_one_and_leave)["status"] == 200
+    time.sleep(1)
+    # The first two misses, plus the two that took their places before the client left.
+    assert len(image_host.downloads("/page/")) <= 4
+
+
+def test_waitress_batch_stops_when_the_client_leaves(ocr_server, image_host, monkeypatch):
+    urls = slow_batch(ocr_server, image_host, monkeypatch)
+    http_server = create_server(ocr_server.app, host="127.0.0.1", port=0, channel_request_lookahead=1)
+    threading.Thread(target=http_server.run, daemon=True).start()
+    try:
+        body = json.dumps({"urls": urls}).encode()
+        with socket.create_connection(("127.0.0.1", http_server.effective_port)) as client:
+            client.sendall(
+                b"POST /ocr/batch HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            received = b""
+            while b'"status"' not in received:
+                received += client.recv(4096)
+        time.sleep(1.5)
+        assert len(image_host.downloads("/page/")) <= 4
+    finally:
+        http_server.close()
@@ -0,0 +1,87 @@
+import threading
+
+import cache
+from conftest import png_bytes
+
+
+ENTRY = {"context": "Cache", "raw": [], "width": 10, "height": 10}
+
+
+def test_memory_lookup_never_reads_the_store(tmp_path):
+    ocr_cache = cache.OcrCache(cache.SQLiteCacheStore(str(tmp_path / "cache.db")), "lazy", 10)
+    ocr_cache.store.put("on-disk", ENTRY)
+    assert ocr_cache.get_from_memory("on-disk") is None
+    assert ocr_cache.stats()["misses"] == 0
+    assert ocr_cache.get("on-disk") == ENTRY
+    assert ocr_cache.get_from_memory("on-disk") == ENTRY
+    assert ocr_cache.stats()["disk_hits"] == 1
+
+
+def test_items_after_walks_in_key_order(tmp_path):
+    store = cache.SQLiteCacheStore(str(tmp_path / "cache.db"))
+    store.put_many({f"key-{index}": ENTRY for index in range(7)})
+    keys, after_key = [], None
+    while batch := store.items_after(after_key, 3):
+        keys += [key for key, _ in batch]
+        after_key = batch[-1][0]
+    assert keys == sorted(f"key-{index}" for index in range(7))
+
+
+def test_store_reads_stay_off_the_event_loop(run_aiohttp, ocr_server, monkeypatch):
+    store = ocr_server.ocr_cache.store
+    store.put_many({f"http://images.test/{index}.png": ENTRY for index in range(3)})
+    reading_threads = []
+    read = store.get
+
+    def recording_get(key):
+        reading_threads.append(threading.current_thread())
+        return read(key)
+
+    monkeypatch.setattr(store, "get", recording_get)
+
+    async def requests(client):
+        single = await client.get("/ocr", params={"url": "http://images.test/0.png"})
+        batch = await client.post("/ocr/batch", json={"urls": [f"http://images.test/{index}.png" for index in range(3)]})
+        return single.status, await batch.text()
+
+    status, batch_body = run_aiohttp(requests)
+    assert status == 200
+    assert batch_body.count('"status": 200') == 3
+    # Page 0 is served from memory the second time; the others are read once each.
+    assert len(reading_threads) == 3
+    assert threading.main_thread() not in reading_threads
+
+
+def test_same_image_under_another_url_reuses_the_result(flask_client, ocr_server, image_host):
+    engine = ocr_server.ocr_engine
+    calls = []
+    recognize = engine.ocr
+
+    async def counting_ocr(img):
+        calls.append(img.size)
+        return await recognize(img)
+
+    engine.ocr = counting_ocr
+    image_host.pages["/page.png"] = image_host.pages["/mirror/page.png?sig=1"] = png_bytes()
+    first, mirror = image_host.url("/page.png"), image_host.url("/mirror/page.png?sig=1")
+
+    original = flask_client.get("/ocr", query_string={"url": first, "context": "first"})
+    aliased = flask_client.get("/ocr", query_string={"url": mirror, "context": "mirror"})
+
+    assert original.status_code == aliased.status_code == 200
+    assert aliased.get_json() == original.get_json()
+    assert len(calls) == 1 and len(image_host.downloads()) == 2
+    first_entry, mirror_entry = ocr_server.ocr_cache.get(first), ocr_server.ocr_cache.get(mirror)
+    assert mirror_entry["context"] == "mirror"
+    assert mirror_entry["content_hash"] == first_entry["content_hash"]
+    assert mirror_entry["raw"] == first_entry["raw"]
+
+
+def test_only_indexed_caches_are_counted(tmp_path):
+    store = cache.SQLiteCacheStore(str(tmp_path / "cache.db"))
+    lazy, indexed = cache.OcrCache(store, "lazy", 10), cache.OcrCache(store, "keys", 10)
+    assert lazy.is_empty() and indexed.is_empty()
+    assert lazy.indexed_count() is None and indexed.indexed_count() == 0
+    indexed.put_many({"a": ENTRY, "b": ENTRY})
+    assert not lazy.is_empty() and not indexed.is_empty()
+    assert lazy.indexed_count() is None and indexed.indexed_count() == 2
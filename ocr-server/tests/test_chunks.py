@@ -0,0 +1,77 @@
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from engines import Engine, OcrLine, join_chunk_lines
+from imaging import plan_chunks
+
+BOX_HEIGHT = 40
+BOX_SPACING = 70
+
+
+class BoxEngine(Engine):
+    """Recognizes every run of dark rows between x=40 and x=160 as one line, cut short
+    when it touches the edge of the image, like a real engine sees a cut line."""
+
+    name = "boxes"
+
+    async def ocr(self, img):
+        dark = (np.asarray(img.convert("L"))[:, 40:160] < 128).any(axis=1)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], dark.astype(np.int8), [0]))))
+        width, height = img.size
+        return [
+            OcrLine(f"line {top}", 40 / width, top / height, 120 / width, (bottom - top) / height)
+            for top, bottom in zip(edges[0::2].tolist(), edges[1::2].tolist())
+        ]
+
+
+def tall_page_without_gutters(height):
+    """Boxes every BOX_SPACING rows, and a dark bar down the left edge so that no row
+    is blank and every chunk has to be cut through content."""
+    pixels = np.full((height, 200), 255, np.uint8)
+    pixels[:, :2] = 0
+    tops = list(range(5, height - BOX_HEIGHT, BOX_SPACING))
+    for top in tops:
+        pixels[top : top + BOX_HEIGHT, 40:160] = 0
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue(), tops
+
+
+def test_plan_chunks_overlaps_cuts_through_content():
+    image_bytes, _ = tall_page_without_gutters(2500)
+    chunks = plan_chunks(Image.open(io.BytesIO(image_bytes)), 1000, 150)
+    assert chunks[0][0] == 0 and chunks[-1][1] == 2500
+    for (_, bottom), (top, _) in zip(chunks, chunks[1:]):
+        assert bottom - top == 150
+
+
+def test_plan_chunks_does_not_pack_bands_across_tall_gutters():
+    pixels = np.full((3000, 800), 255, np.uint8)
+    pixels[0:100, 100:700] = 0
+    pixels[1300:1400, 100:700] = 0
+    pixels[1420:1500, 100:700] = 0
+    assert plan_chunks(Image.fromarray(pixels), 1500, 150) == [(0, 104), (1296, 1504)]
+
+
+def test_tall_image_lines_are_seen_whole_and_once(ocr_server, monkeypatch):
+    monkeypatch.setattr(ocr_server, "ocr_engine", BoxEngine())
+    monkeypatch.setattr(ocr_server, "MAX_CHUNK_HEIGHT", 1000)
+    image_bytes, tops = tall_page_without_gutters(2600)
+
+    result = asyncio.run(ocr_server.recognize_image(image_bytes, "test"))
+
+    boxes = sorted(
+        (round(bubble["tightBoundingBox"]["y"] * 2600), round(bubble["tightBoundingBox"]["height"] * 2600))
+        for bubble in result["raw"]
+    )
+    assert boxes == [(top, BOX_HEIGHT) for top in tops]
+
+
+def test_join_chunk_lines_keeps_lines_outside_the_overlap():
+    above = [OcrLine("a", 0.1, 0.1, 0.2, 0.1), OcrLine("cut", 0.1, 0.45, 0.2, 0.05)]
+    below = [OcrLine("whole", 0.1, 0.45, 0.2, 0.1), OcrLine("beside", 0.6, 0.45, 0.2, 0.1)]
+    joined = join_chunk_lines([above, below], [(0, 50), (40, 100)], 100)
+    assert [line.text for line in joined] == ["a", "whole", "beside"]
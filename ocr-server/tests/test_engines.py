@@ -0,0 +1,64 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import engines
+from engines import GoogleLens, OneOCR
+
+
+class FakeLensAPI:
+    def __init__(self):
+        self.calls = []
+
+    async def process_image(self, image_path, ocr_language, output_format):
+        self.calls.append((threading.current_thread(), image_path.size, image_path.mode))
+        return {"word_data": [], "line_blocks": []}
+
+
+def test_lens_fits_images_to_the_upload_size():
+    assert GoogleLens.fit_for_upload(Image.new("L", (3000, 2000))).size == (1600, 1066)
+    assert GoogleLens.fit_for_upload(Image.new("L", (1600, 900))).size == (1600, 900)
+    assert GoogleLens.fit_for_upload(Image.new("L", (1000, 5000))).size == (320, 1600)
+    assert GoogleLens.fit_for_upload(Image.new("L", (10, 10))).mode == "RGB"
+
+
+def test_lens_prepares_images_off_the_calling_loop():
+    engine = GoogleLens()
+    engine.engine = FakeLensAPI()
+
+    async def recognize():
+        return await engine.ocr(Image.new("L", (3000, 2000), 255))
+
+    assert asyncio.run(recognize()) == []
+    [(thread, size, mode)] = engine.engine.calls
+    assert thread is not threading.current_thread()
+    assert size == (1600, 1066) and mode == "RGB"
+
+
+def test_oneocr_shares_images_off_the_calling_loop(monkeypatch):
+    shared = []
+
+    class RecordedSharedImage(engines.SharedImage):
+        def __init__(self, img):
+            super().__init__(img)
+            self.thread = threading.current_thread()
+            self.closed = False
+            shared.append(self)
+
+        def close(self):
+            super().close()
+            self.closed = True
+
+    monkeypatch.setattr(engines, "SharedImage", RecordedSharedImage)
+    monkeypatch.setattr(engines, "_recognize_shared_chunk", lambda name, size, box: {"lines": []})
+    engine = OneOCR(workers=0)
+    engine.executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        assert asyncio.run(engine.ocr(Image.new("L", (200, 400), 0))) == []
+    finally:
+        engine.executor.shutdown()
+    [image] = shared
+    assert image.thread is not threading.current_thread()
+    assert image.closed
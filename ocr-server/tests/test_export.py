@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+
+def fill_cache(ocr_server, count):
+    entries = {
+        f"http://images.test/{index:05d}.png": {"context": "Export", "raw": [], "width": 10, "height": 10}
+        for index in range(count)
+    }
+    ocr_server.ocr_cache.put_many(entries)
+    return entries
+
+
+@pytest.mark.parametrize("count", [0, 1, 500, 1234])
+def test_export_batches_join_into_one_object(ocr_server, count):
+    entries = fill_cache(ocr_server, count)
+    chunks = list(ocr_server.export_cache_chunks())
+    assert json.loads("".join(chunks)) == entries
+    assert len(chunks) == count // ocr_server.EXPORT_BATCH_SIZE + 1
+
+
+def test_export_flask(flask_client, ocr_server):
+    entries = fill_cache(ocr_server, 1234)
+    response = flask_client.get("/export-cache")
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == entries
+
+
+def test_export_aiohttp_past_one_batch(run_aiohttp, ocr_server):
+    entries = fill_cache(ocr_server, 1234)
+
+    async def export(client):
+        response = await client.get("/export-cache")
+        return response.status, await response.text()
+
+    status, body = run_aiohttp(export)
+    assert status == 200
+    assert json.loads(body) == entries
+
+
+def test_export_empty_cache_is_404(run_aiohttp):
+    async def export(client):
+        return (await client.get("/export-cache")).status
+
+    assert run_aiohttp(export) == 404
+
+
+def test_lazy_cache_is_never_counted(flask_client, ocr_server, monkeypatch):
+    def count():
+        raise AssertionError("counted the whole cache")
+
+    monkeypatch.setattr(ocr_server.ocr_cache.store, "count", count)
+    assert flask_client.get("/export-cache").status_code == 404
+    fill_cache(ocr_server, 3)
+    assert flask_client.get("/export-cache").status_code == 200
+    assert flask_client.get("/").get_json()["items_in_cache"] is None
+    metrics = flask_client.get("/metrics").get_data(as_text=True).splitlines()
+    assert "# TYPE ocr_cache_entries gauge" in metrics
+    assert not any(line.startswith("ocr_cache_entries ") for line in metrics)
@@ -0,0 +1,88 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from imaging import ImageTooLargeError, decode_image
+
+
+def encode(img, image_format, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def noise(width, height, mode="RGB"):
+    return Image.effect_noise((width, height), 64).convert(mode)
+
+
+def test_small_images_are_decoded_as_they_are():
+    img, size, shrunk_by = decode_image(encode(noise(120, 80, "L"), "PNG"), ("RGB", "L"))
+    assert (img.size, img.mode, size, shrunk_by) == ((120, 80), "L", (120, 80), 1)
+
+
+def test_jpeg_is_scaled_while_decoding_to_the_pixel_limit():
+    img, size, shrunk_by = decode_image(encode(noise(1600, 1200), "JPEG"), max_decoded_pixels=200_000)
+    assert size == (1600, 1200)
+    # 1.92 MP needs a factor of 4 to get under 0.2 MP; JPEG decodes at 1/4 directly.
+    assert shrunk_by == 4 and img.size == (400, 300)
+
+
+def test_jpeg_shrinks_to_the_engine_width_but_no_further():
+    img, _, shrunk_by = decode_image(encode(noise(1600, 1200), "JPEG"), min_width=lambda w, h: 500)
+    assert shrunk_by == 2 and img.width >= 500
+
+
+def test_png_is_reduced_to_the_pixel_limit():
+    img, _, shrunk_by = decode_image(encode(noise(900, 600), "PNG"), max_decoded_pixels=60_000)
+    assert shrunk_by == 3 and img.size == (300, 200) and img.width * img.height <= 60_000
+
+
+def test_png_over_the_unscaled_limit_is_refused():
+    data = encode(noise(900, 600), "PNG")
+    with pytest.raises(ImageTooLargeError):
+        decode_image(data, max_decoded_pixels=60_000, max_unscaled_pixels=500_000)
+    # JPEGs are scaled while decoding, so the unscaled limit does not apply to them.
+    decode_image(encode(noise(900, 600), "JPEG"), max_decoded_pixels=60_000, max_unscaled_pixels=500_000)
+
+
+def test_images_over_the_header_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 10_000)
+    with pytest.raises(ImageTooLargeError):
+        decode_image(encode(noise(300, 300), "PNG"))
+
+
+@pytest.mark.parametrize("mode", ["P", "1", "RGBA", "LA"])
+def test_reduce_then_convert_matches_convert_then_reduce(mode, monkeypatch):
+    monkeypatch.setattr("imaging.CONVERT_STRIP_HEIGHT", 64)
+    source = noise(301, 997).convert(mode)
+    img, _, shrunk_by = decode_image(encode(source, "PNG"), max_decoded_pixels=20_000)
+    expected = source.convert("RGB").reduce(shrunk_by)
+    assert img.mode == "RGB" and img.size == expected.size
+    if mode in ("P", "1"):
+        # Converted in strips: the same pixels as converting the whole image first.
+        assert img.tobytes() == expected.tobytes()
+
+
+def test_palette_image_is_not_converted_at_full_size(monkeypatch):
+    converted = []
+    original_convert = Image.Image.convert
+
+    def recording_convert(self, mode=None, *args, **kwargs):
+        converted.append(self.size)
+        return original_convert(self, mode, *args, **kwargs)
+
+    data = encode(noise(400, 4000).convert("P"), "PNG")
+    monkeypatch.setattr(Image.Image, "convert", recording_convert)
+    decode_image(data, max_decoded_pixels=100_000)
+    assert converted and max(width * height for width, height in converted) < 400 * 4000 // 2
+
+
+def test_shrunk_images_report_their_original_size(ocr_server, monkeypatch):
+    monkeypatch.setattr(ocr_server, "MAX_DECODED_PIXELS", 60_000)
+    result = asyncio.run(ocr_server.recognize_image(encode(noise(900, 600), "JPEG"), "test"))
+    assert (result["width"], result["height"]) == (900, 600)
+    for bubble in result["raw"]:
+        box = bubble["tightBoundingBox"]
+        assert 0 <= box["x"] and box["x"] + box["width"] <= 1.01
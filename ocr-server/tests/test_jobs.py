@@ -0,0 +1,138 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from conftest import png_bytes
+from jobs import JobQueue, JobQueueFull
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_a_chapter_is_queued_once(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lambda job: None)
+    job, created = queue.submit("http://host/chapter/", "ctx")
+    again, created_again = queue.submit("http://host/chapter/", "other")
+    assert created and not created_again and again is job
+
+
+def test_submit_refuses_past_the_pending_limit(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lambda job: None, max_pending=2)
+    queue.submit("http://host/a/", "ctx")
+    queue.submit("http://host/b/", "ctx")
+    with pytest.raises(JobQueueFull):
+        queue.submit("http://host/c/", "ctx")
+
+
+def test_queued_jobs_survive_a_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first = JobQueue(path, lambda job: None)
+    job, _ = first.submit("http://host/chapter/", "ctx", page_count=3)
+    first.set_page_count(job, 12)
+
+    ran = []
+    done = threading.Event()
+    restarted = JobQueue(path, lambda job: (ran.append(job), done.set()))
+    assert restarted.start() == 1
+    assert done.wait(5)
+    assert (ran[0].id, ran[0].base_url, ran[0].page_count) == (job.id, job.base_url, 12)
+
+
+def test_credentials_are_never_written_to_disk(tmp_path):
+    path = tmp_path / "jobs.db"
+    queue = JobQueue(str(path), lambda job: None)
+    job, _ = queue.submit("http://host/private/", "ctx", "reader", "hunter2")
+    assert job.password == "hunter2"
+    queue._conn.close()
+    assert b"hunter2" not in path.read_bytes()
+    assert JobQueue(str(path), lambda job: None).start() == 0
+
+
+def test_jobs_with_credentials_from_older_versions_are_dropped(tmp_path):
+    path = tmp_path / "jobs.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, base_url TEXT NOT NULL, context TEXT NOT NULL,"
+        " user TEXT, password TEXT, created_at REAL NOT NULL, page_count INTEGER)"
+    )
+    conn.execute("INSERT INTO jobs VALUES ('a', 'http://host/a/', 'ctx', 'reader', 'hunter2', 1, NULL)")
+    conn.execute("INSERT INTO jobs VALUES ('b', 'http://host/b/', 'ctx', NULL, NULL, 2, NULL)")
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(str(path), lambda job: None)
+    assert [job.id for job in queue.jobs()] == []
+    assert queue.start() == 1
+    assert b"hunter2" not in path.read_bytes()
+
+
+def test_cancelled_queued_job_never_runs(tmp_path):
+    ran = []
+    queue = JobQueue(str(tmp_path / "jobs.db"), ran.append)
+    job, _ = queue.submit("http://host/chapter/", "ctx")
+    assert queue.cancel(job.id) is job and job.state == "cancelled"
+    queue.start()
+    time.sleep(0.1)
+    assert ran == [] and queue.counts() == {"queued": 0, "running": 0}
+    assert queue.cancel("unknown") is None
+
+
+def host_chapter(image_host, pages):
+    for index in range(pages):
+        image_host.pages[f"/chapter/{index}"] = png_bytes(200, 300)
+    return image_host.url("/chapter/")
+
+
+def test_chapter_job_probes_its_length_and_reads_every_page(flask_client, ocr_server, image_host):
+    base_url = host_chapter(image_host, 5)
+    ocr_server.start_job_queue()
+    response = flask_client.post("/preprocess-chapter", json={"baseUrl": base_url, "context": "ctx"})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    job = next(job for job in ocr_server.job_queue.jobs() if job.id == job_id)
+    wait_for(lambda: job.state == "done")
+    assert (job.page_count, job.pages_done) == (5, 5)
+    assert sorted(image_host.downloads("/chapter/")) == [f"/chapter/{index}" for index in range(5)]
+    assert all(ocr_server.ocr_cache.get(f"{base_url}{index}") for index in range(5))
+
+    again = flask_client.post("/preprocess-chapter", json={"baseUrl": base_url, "context": "ctx"})
+    second = next(job for job in ocr_server.job_queue.jobs() if job.id == again.get_json()["job_id"])
+    wait_for(lambda: second.state == "done")
+    assert second.pages_cached == 5
+
+
+def test_running_chapter_job_can_be_cancelled(run_aiohttp, ocr_server, image_host):
+    base_url = host_chapter(image_host, 40)
+    image_host.delay = 0.05
+
+    async def cancel_while_running(client):
+        response = await client.post("/preprocess-chapter", json={"baseUrl": base_url, "pageCount": 40})
+        job_id = (await response.json())["job_id"]
+        job = next(job for job in ocr_server.job_queue.jobs() if job.id == job_id)
+        while job.pages_done < 2:
+            await asyncio.sleep(0.01)
+        cancelled = await client.post(f"/jobs/{job_id}/cancel")
+        assert cancelled.status == 200
+        started = time.monotonic()
+        while job.state == "running":
+            await asyncio.sleep(0.01)
+        jobs = await (await client.get("/jobs")).json()
+        return job, time.monotonic() - started, jobs
+
+    job, took, jobs = run_aiohttp(cancel_while_running)
+    assert job.state == "cancelled" and took < 2
+    assert job.pages_done < 40
+    assert jobs["jobs"][0]["id"] == job.id and jobs["jobs"][0]["state"] == "cancelled"
+    downloads = len(image_host.downloads("/chapter/"))
+    time.sleep(0.3)
+    assert len(image_host.downloads("/chapter/")) == downloads
+
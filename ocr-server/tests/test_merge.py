@@ -0,0 +1,122 @@
+import random
+import sys
+from collections import defaultdict
+
+import pytest
+
+from benchmarks.layouts import generate_layout
+from engines import OcrLine
+
+PRESETS = [
+    {},
+    {"dist_k": 0.8, "font_ratio": 1.15, "overlap_min": 0.3},
+    {"dist_k": 2.0, "font_ratio": 1.6, "overlap_min": 0.05},
+    {"overlap_min": 0},
+]
+
+
+def baseline_groups(lines, natural_width, natural_height, config):
+    """The grouping of the original server, which compared every pair of lines. It
+    worked in windows of 3000 rows, so it only matches for images up to that height."""
+    assert natural_height <= 3000
+    norm_scale = 1000 / natural_width
+    boxes = []
+    for line in lines:
+        x, y = line.x * natural_width * norm_scale, line.y * natural_height * norm_scale
+        width, height = line.width * natural_width * norm_scale, line.height * natural_height * norm_scale
+        is_vertical = width <= height
+        boxes.append((is_vertical, width if is_vertical else height, x, y, width, height, x + width, y + height))
+
+    def median(data):
+        data = sorted(data)
+        if not data:
+            return 0
+        mid = len(data) // 2
+        return (data[mid - 1] + data[mid]) / 2.0 if len(data) % 2 == 0 else data[mid]
+
+    initial_h = median([b[5] for b in boxes if not b[0]])
+    initial_w = median([b[4] for b in boxes if b[0]])
+    median_h = median([b[5] for b in boxes if not b[0] and b[5] >= initial_h * config["min_line_ratio"]]) or initial_h or 20
+    median_w = median([b[4] for b in boxes if b[0] and b[4] >= initial_w * config["min_line_ratio"]]) or initial_w or 20
+
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+            va, fa, xa, ya, wa, ha, ra, ba = boxes[i]
+            vb, fb, xb, yb, wb, hb, rb, bb = boxes[j]
+            if va != vb:
+                continue
+            a_primary = fa >= (median_w if va else median_h) * config["min_line_ratio"]
+            b_primary = fb >= (median_w if vb else median_h) * config["min_line_ratio"]
+            threshold = config["font_ratio_for_mixed"] if a_primary != b_primary else config["font_ratio"]
+            if max(fa / fb, fb / fa) > threshold:
+                continue
+            if va:
+                gap = max(0, max(xa, xb) - min(ra, rb))
+                overlap = max(0, min(ba, bb) - max(ya, yb))
+            else:
+                gap = max(0, max(ya, yb) - min(ba, bb))
+                overlap = max(0, min(ra, rb) - max(xa, xb))
+            smaller = min(ha if va else wa, hb if vb else wb)
+            if gap > (median_w if va else median_h) * config["dist_k"]:
+                continue
+            if smaller > 0 and overlap / smaller < config["overlap_min"]:
+                continue
+            if a_primary != b_primary and smaller > 0 and overlap / smaller < config["mixed_min_overlap_ratio"]:
+                continue
+            parent[find(j)] = find(i)
+
+    groups = defaultdict(set)
+    for i in range(len(boxes)):
+        groups[find(i)].add(i)
+    return {frozenset(group) for group in groups.values()}
+
+
+def server_groups(ocr_server, monkeypatch, path, lines, width, height, config):
+    monkeypatch.setattr(ocr_server, "NUMPY_MERGE_MIN_LINES", 0 if path == "numpy" else sys.maxsize)
+    index = {id(line): position for position, line in enumerate(lines)}
+    groups = ocr_server._group_ocr_data(lines, width, height, config)
+    return {frozenset(index[id(line)] for line in group) for group in groups}
+
+
+def with_zero_size_boxes(lines, seed):
+    """Adds boxes of zero width, height or both on top of existing lines."""
+    rnd = random.Random(seed)
+    extra = []
+    for line in rnd.sample(lines, min(len(lines), 12)):
+        width, height = rnd.choice([(0, 0), (0, line.height), (line.width, 0)])
+        extra.append(OcrLine("zero", line.x, line.y, width, height))
+    return lines + extra
+
+
+@pytest.mark.parametrize("preset", range(len(PRESETS)))
+@pytest.mark.parametrize("layout,line_count,seed", [("page", 50, 0), ("page", 200, 1), ("furigana", 200, 2), ("furigana", 400, 3)])
+def test_numpy_python_and_baseline_group_alike(ocr_server, monkeypatch, layout, line_count, seed, preset):
+    lines, width, height = generate_layout(layout, line_count, seed)
+    config = {**ocr_server.AUTO_MERGE_CONFIG, **PRESETS[preset]}
+    expected = baseline_groups(lines, width, height, config)
+    assert server_groups(ocr_server, monkeypatch, "python", lines, width, height, config) == expected
+    assert server_groups(ocr_server, monkeypatch, "numpy", lines, width, height, config) == expected
+
+
+@pytest.mark.parametrize("preset", range(len(PRESETS)))
+@pytest.mark.parametrize("seed", range(4))
+def test_zero_size_boxes_are_never_merged(ocr_server, monkeypatch, seed, preset):
+    lines, width, height = generate_layout("page", 120, seed)
+    lines = with_zero_size_boxes(lines, seed)
+    config = {**ocr_server.AUTO_MERGE_CONFIG, **PRESETS[preset]}
+    # The original server divided by the zero font size.
+    with pytest.raises(ZeroDivisionError):
+        baseline_groups(lines, width, height, config)
+
+    python = server_groups(ocr_server, monkeypatch, "python", lines, width, height, config)
+    numpy = server_groups(ocr_server, monkeypatch, "numpy", lines, width, height, config)
+    assert python == numpy
+    zero_size = {index for index, line in enumerate(lines) if line.text == "zero"}
+    assert {frozenset([index]) for index in zero_size} <= python
@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.mark.parametrize("value", ["nan", "NaN", "inf", "-inf", "-0.5", "abc", ""])
+def test_invalid_merge_values_are_refused(ocr_server, value):
+    with pytest.raises(ValueError):
+        ocr_server.merge_config_from_args({"dist_k": value})
+
+
+def test_merge_values_override_the_defaults(ocr_server):
+    config = ocr_server.merge_config_from_args({"dist_k": "2.5", "font_ratio": "0", "auto_merge": "off", "other": "x"})
+    assert config["dist_k"] == 2.5 and config["font_ratio"] == 0 and config["enabled"] is False
+    assert "other" not in config
+
+
+def test_ocr_answers_400_for_invalid_merge_values(flask_client):
+    response = flask_client.get("/ocr", query_string={"url": "http://images.test/0.png", "dist_k": "nan"})
+    assert response.status_code == 400
+    assert "dist_k" in response.get_json()["error"]
+
+
+def test_batch_answers_400_for_invalid_merge_values(run_aiohttp):
+    async def post(client):
+        response = await client.post("/ocr/batch", params={"perp_tol": "-1"}, json={"urls": ["http://images.test/0.png"]})
+        return response.status, await response.json()
+
+    status, payload = run_aiohttp(post)
+    assert status == 400 and "perp_tol" in payload["error"]
@@ -0,0 +1,40 @@
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Metric, render_metrics
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("base", "Has no samples.")
+
+
+def test_render_counter_gauge_and_histogram():
+    requests = Counter("requests_total", "Requests.", ("result",))
+    requests.inc(result="hit")
+    requests.inc(2, result="miss")
+    queued = Gauge("queued", "Queued jobs.", lambda: 3)
+    duration = Histogram("duration_seconds", "Duration.", ("stage",), buckets=(0.1, 1))
+    duration.observe(0.05, stage="fetch")
+    duration.observe(0.5, stage="fetch")
+
+    assert render_metrics([requests, queued, duration]).splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{result="hit"} 1',
+        'requests_total{result="miss"} 2',
+        "# HELP queued Queued jobs.",
+        "# TYPE queued gauge",
+        "queued 3",
+        "# HELP duration_seconds Duration.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{stage="fetch",le="0.1"} 1',
+        'duration_seconds_bucket{stage="fetch",le="1.0"} 2',
+        'duration_seconds_bucket{stage="fetch",le="+Inf"} 2',
+        'duration_seconds_sum{stage="fetch"} 0.55',
+        'duration_seconds_count{stage="fetch"} 2',
+    ]
+
+
+def test_labels_must_match():
+    with pytest.raises(ValueError):
+        Counter("requests_total", "Requests.", ("result",)).inc(stage="x")
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from conftest import png_bytes
+from engines import StubEngine
+
+CALLERS = 5
+
+
+class CountingEngine(StubEngine):
+    """Slow enough for every caller to arrive while the first is in flight; fails
+    every call with `error` when it is set."""
+
+    def __init__(self, error=None):
+        super().__init__(latency=0.3, lines=4)
+        self.error = error
+        self.calls = 0
+
+    async def ocr(self, img):
+        self.calls += 1
+        lines = await super().ocr(img)
+        if self.error:
+            raise self.error
+        return lines
+
+
+@pytest.fixture
+def flights(ocr_server, monkeypatch):
+    monkeypatch.setattr(ocr_server, "ocr_flights", ocr_server.SingleFlight())
+    return ocr_server.ocr_flights
+
+
+def concurrent_requests(run_aiohttp, url, callers=CALLERS):
+    async def request_all(client):
+        async def get():
+            response = await client.get("/ocr", params={"url": url})
+            return response.status, await response.json()
+
+        return await asyncio.gather(*(get() for _ in range(callers)))
+
+    return run_aiohttp(request_all)
+
+
+def test_concurrent_misses_share_one_recognition(run_aiohttp, ocr_server, image_host, flights, monkeypatch):
+    engine = CountingEngine()
+    monkeypatch.setattr(ocr_server, "ocr_engine", engine)
+    image_host.pages["/page.png"] = png_bytes()
+    url = image_host.url("/page.png")
+
+    responses = concurrent_requests(run_aiohttp, url)
+
+    assert engine.calls == 1 and image_host.downloads() == ["/page.png"]
+    assert flights.coalesced_requests == CALLERS - 1 and flights.in_flight() == 0
+    status, payload = responses[0]
+    assert status == 200 and payload
+    assert all(response == (status, payload) for response in responses)
+
+
+def test_a_failed_leader_fails_every_caller_once(run_aiohttp, ocr_server, image_host, flights, monkeypatch):
+    engine = CountingEngine(RuntimeError("engine failed"))
+    monkeypatch.setattr(ocr_server, "ocr_engine", engine)
+    image_host.pages["/page.png"] = png_bytes()
+    url = image_host.url("/page.png")
+
+    responses = concurrent_requests(run_aiohttp, url)
+
+    assert engine.calls == 1 and flights.in_flight() == 0
+    assert all(status == 500 and "engine failed" in payload["error"] for status, payload in responses)
+    assert ocr_server.ocr_cache.get(url) is None
+
+    # Failures are not remembered, the next request tries again.
+    engine.error = None
+    [(status, _)] = concurrent_requests(run_aiohttp, url, callers=1)
+    assert status == 200 and engine.calls == 2
+
+
+def test_single_flight_hands_the_leaders_result_to_every_caller(ocr_server):
+    flights = ocr_server.SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return {"lines": len(calls)}
+
+    async def fail():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        raise ValueError("no")
+
+    async def main():
+        results = await asyncio.gather(*(flights.run("key", work) for _ in range(CALLERS)))
+        failures = await asyncio.gather(*(flights.run("key", fail) for _ in range(CALLERS)), return_exceptions=True)
+        return results, failures
+
+    results, failures = asyncio.run(main())
+    assert results == [{"lines": 1}] * CALLERS
+    assert len(calls) == 2
+    assert all(isinstance(failure, ValueError) for failure in failures)
+    assert flights.in_flight() == 0 and flights.coalesced_requests == 2 * (CALLERS - 1)
@@ -0,0 +1,125 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+from PIL import Image
+
+from engines import StubEngine
+
+
+def tall_page(image_host, monkeypatch, ocr_server):
+    monkeypatch.setattr(ocr_server, "MAX_CHUNK_HEIGHT", 1000)
+    buffer = io.BytesIO()
+    Image.effect_noise((200, 2500), 64).convert("L").save(buffer, "PNG")
+    image_host.pages["/tall.png"] = buffer.getvalue()
+    return image_host.url("/tall.png")
+
+
+def parse_ndjson(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append({"event": event[len("event: "):], **json.loads(data[len("data: "):])})
+    return events
+
+
+def check_stream(events):
+    chunks, result = events[:-1], events[-1]
+    chunk_count = len(chunks)
+    assert chunk_count > 1
+    assert [event["event"] for event in chunks] == ["chunk"] * chunk_count
+    assert sorted(event["chunk"] for event in chunks) == list(range(chunk_count))
+    assert all(event["chunks"] == chunk_count and event["data"] for event in chunks)
+    assert result["event"] == "result" and result["status"] == 200
+    assert result["data"] and "total;dur=" in result["server_timing"]
+
+
+@pytest.mark.parametrize("query,accept,parse", [
+    ({"stream": "ndjson"}, None, parse_ndjson),
+    ({"stream": "1"}, "text/event-stream", parse_sse),
+    ({}, "application/x-ndjson", parse_ndjson),
+])
+def test_flask_streams_chunks_then_the_result(flask_client, ocr_server, image_host, monkeypatch, query, accept, parse):
+    url = tall_page(image_host, monkeypatch, ocr_server)
+    headers = {"Accept": accept} if accept else {}
+    response = flask_client.get("/ocr", query_string={"url": url, **query}, headers=headers)
+    assert response.status_code == 200
+    check_stream(parse(response.get_data(as_text=True)))
+
+    # Now cached: only the result is sent.
+    cached = parse(flask_client.get("/ocr", query_string={"url": url, **query}, headers=headers).get_data(as_text=True))
+    assert [event["event"] for event in cached] == ["result"]
+
+
+def test_aiohttp_streams_chunks_then_the_result(run_aiohttp, ocr_server, image_host, monkeypatch):
+    url = tall_page(image_host, monkeypatch, ocr_server)
+
+    async def stream(client):
+        response = await client.get("/ocr", params={"url": url}, headers={"Accept": "text/event-stream"})
+        return response.headers["Content-Type"], await response.text()
+
+    content_type, body = run_aiohttp(stream)
+    assert content_type == "text/event-stream"
+    check_stream(parse_sse(body))
+
+
+class StaggeredEngine(StubEngine):
+    """Each call takes `latency` seconds longer than the one before it, so the chunks
+    of a tall page are recognized one after the other."""
+
+    def __init__(self, latency):
+        super().__init__(lines=4)
+        self.step = latency
+        self.calls = 0
+
+    async def ocr(self, img):
+        self.calls += 1
+        await asyncio.sleep(self.step * self.calls)
+        return await super().ocr(img)
+
+
+def test_flask_stream_closed_by_the_client_still_caches(flask_client, ocr_server, image_host, monkeypatch):
+    url = tall_page(image_host, monkeypatch, ocr_server)
+    monkeypatch.setattr(ocr_server, "ocr_engine", StaggeredEngine(0.3))
+    response = flask_client.get("/ocr", query_string={"url": url, "stream": "ndjson"}, buffered=False)
+    [first] = parse_ndjson(next(iter(response.response)).decode())
+    assert first["event"] == "chunk"
+    # Closes the stream's loop while the chunks below the first are being recognized.
+    response.close()
+
+    deadline = time.monotonic() + 10
+    while ocr_server.ocr_cache.get(url) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert ocr_server.ocr_cache.get(url) is not None
+    assert ocr_server.ocr_engine.calls == first["chunks"]
+
+
+def test_plain_requests_are_not_streamed(flask_client, ocr_server, image_host, monkeypatch):
+    url = tall_page(image_host, monkeypatch, ocr_server)
+    response = flask_client.get("/ocr", query_string={"url": url})
+    assert response.mimetype == "application/json" and "total;dur=" in response.headers["Server-Timing"]
+    assert isinstance(response.get_json(), list)
+
+
+def test_streamed_errors_are_sent_as_the_result(flask_client, image_host):
+    response = flask_client.get("/ocr", query_string={"url": image_host.url("/missing"), "stream": "ndjson"})
+    [result] = parse_ndjson(response.get_data(as_text=True))
+    assert result["event"] == "result" and result["status"] == 404 and "error" in result
+
+
+@pytest.mark.parametrize("args,accept,expected", [
+    ({"url": "u", "stream": "sse"}, "", "sse"),
+    ({"url": "u", "stream": "true"}, "", "ndjson"),
+    ({"url": "u"}, "text/event-stream", "sse"),
+    ({"url": "u"}, "application/json", None),
+    ({"stream": "sse"}, "", None),
+])
+def test_stream_format(ocr_server, args, accept, expected):
+    assert ocr_server.stream_format(args, accept) == expected